@@ -3,50 +3,473 @@ State manager for n8n-based agent orchestration.
 Persists all data to Supabase via REST API.
 """
 import asyncio
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Callable, Optional
+import functools
+import inspect
+import logging
+import math
+import sys
+import time
+import types
+from collections import Counter, OrderedDict, deque
+from itertools import chain, islice
+from operator import itemgetter
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, Optional
 
 import httpx
+import orjson
+
+logger = logging.getLogger("supabase")
 
 
 # ── Agent catalogue ───────────────────────────────────────────────────────────
-AGENT_DEFS = {
+AGENT_DEFS = types.MappingProxyType({
     "manager":    {"id": 0, "name": "Manager",    "role": "Orchestrator",      "emoji": "🎯", "color": "#a78bfa"},
     "researcher": {"id": 1, "name": "Researcher", "role": "Web Researcher",    "emoji": "🔍", "color": "#38bdf8"},
     "writer":     {"id": 2, "name": "Writer",     "role": "Spec & Content",    "emoji": "✍️", "color": "#34d399"},
     "coder":      {"id": 3, "name": "Coder",      "role": "Code Generator",    "emoji": "💻", "color": "#f472b6"},
     "qa":         {"id": 5, "name": "QA",         "role": "Quality Assurance", "emoji": "🛡️", "color": "#f59e0b"},
     "deployer":   {"id": 4, "name": "Deployer",   "role": "Publisher",         "emoji": "🚀", "color": "#fb923c"},
-}
+})
+AGENT_KEYS = frozenset(AGENT_DEFS)
+_AGENT_ITEMS = tuple(AGENT_DEFS.items())
+# PostgREST filter matching any known agent key
+_AGENT_IN = f"in.({','.join(AGENT_DEFS)})"
+
+# Positional AgentState constructor args (key, id, name, role, emoji, color), built once
+_AGENT_TEMPLATES = tuple(
+    (k, v["id"], v["name"], v["role"], v["emoji"], v["color"]) for k, v in _AGENT_ITEMS
+)
+
+# Known agent statuses, interned so every AgentState/snapshot shares the same objects
+_STATUSES = {s: sys.intern(s) for s in ("idle", "thinking", "working", "done", "error", "quest")}
+
+# Window (seconds) in which WS events from bursty n8n callbacks are coalesced
+BROADCAST_BATCH_WINDOW = 0.005
+
+# Minimum interval (seconds) between agent_update frames for one agent;
+# intermediate progress ticks are dropped, the latest state is always sent
+AGENT_UPDATE_INTERVAL = 0.05
+# Statuses that bypass the agent_update rate limit
+_FLUSH_STATUSES = frozenset(("idle", "done", "error"))
+
+# Chat messages kept in memory (oldest evicted first)
+HISTORY_LIMIT = 200
+# After a failed history load, connections skip it for this long (s) before retrying
+HISTORY_RETRY_DELAY = 30.0
+
+# Chat rows are persisted in bulk: up to this many per insert, gathered over this window (s)
+MESSAGE_BATCH_SIZE = 50
+MESSAGE_BATCH_WINDOW = 0.05
+# Unsaved chat/diary rows held at most; past this new rows are dropped (with a warning)
+MESSAGE_QUEUE_MAX = 10_000
+# Background tasks (see StateManager._spawn) talking to Supabase at once
+BACKGROUND_CONCURRENCY = 8
+# Background tasks held at most (running or waiting); past this new work is dropped
+BACKGROUND_TASKS_MAX = 1_000
+
+# Supabase connection pool. HTTP/2 multiplexes concurrent requests over a few
+# sockets, so a small pool covers every gather() in this module
+SUPABASE_MAX_CONNECTIONS = 15
+SUPABASE_MAX_KEEPALIVE = 10
+
+# Single-row inserts via SupabaseClient.queue_insert are merged per table over this
+# window (s) and sent as one array body of at most this many rows
+INSERT_MERGE_WINDOW = 0.05
+INSERT_MERGE_LIMIT = 100
+# ...and by-id PATCH/DELETE via queue_update/queue_delete over this window, at
+# most this many ids per `id=in.(...)` request
+WRITE_MERGE_WINDOW = 0.05
+WRITE_MERGE_LIMIT = 100
+
+# Single-row lookups by primary key (SupabaseClient.select_by_id): entry lifetime (s)
+# and bound; rows are dropped individually when written through the client
+BY_ID_CACHE_TTL = 30.0
+BY_ID_CACHE_SIZE = 256
+
+# select_stream page size and the most rows one stream will read
+STREAM_PAGE_SIZE = 500
+STREAM_MAX_ROWS = 50_000
+
+# Conditional-GET validators kept per distinct select (see SupabaseClient.select)
+ETAG_CACHE_SIZE = 128
+
+# Read cache for dashboard getters: entries are fresh this long (s), at most this many
+READ_CACHE_TTL = 2.0
+READ_CACHE_SIZE = 128
+# ...and past the TTL are served stale for this long (s) while refreshed in background
+READ_CACHE_STALE = 10.0
+# Analytics/briefing aggregates cover days; they are recomputed at most this often (s).
+# Only complete results are kept: a failed RPC or fallback query is never cached
+AGGREGATE_CACHE_TTL = 60.0
+# Briefing diary entries carry at most this much content (see migrations/007)
+BRIEFING_PREVIEW_CHARS = 280
+
+# System memories and user profile change rarely; get_memory_context keeps them this long (s)
+WARM_CACHE_TTL = 300.0
+
+# Constant part of chat messages typed by the user
+_USER_TPL = {"role": "user", "name": "Вы", "emoji": "👤", "color": "#6366f1"}
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+_hm_cached = ("", float("-inf"))
+
+
+def _now_hm() -> str:
+    """Local "HH:MM" for chat messages, re-formatted at most once per second."""
+    global _hm_cached
+    t = time.monotonic()
+    if t - _hm_cached[1] < 1.0:
+        return _hm_cached[0]
+    now = datetime.now()
+    s = f"{now.hour:02d}:{now.minute:02d}"
+    _hm_cached = (s, t)
+    return s
+
+
+_iso_cached = ("", -1)
+
+
+def _utc_iso() -> str:
+    """Current UTC time for DB timestamp columns (second precision), formatted once per second."""
+    global _iso_cached
+    sec = int(time.time())
+    if sec == _iso_cached[1]:
+        return _iso_cached[0]
+    s = datetime.fromtimestamp(sec, timezone.utc).isoformat()
+    _iso_cached = (s, sec)
+    return s
+
+
+def _utc_since(seconds: int) -> str:
+    """
+    UTC timestamp `seconds` ago, floored to a 10 s bucket so repeated polls
+    send the identical filter string (and can hit the ETag / read caches).
+    """
+    bucket = int(time.time()) // 10 * 10
+    return datetime.fromtimestamp(bucket - seconds, timezone.utc).isoformat()
+
+
+def _day_series(since: str, counts: dict) -> dict[str, int]:
+    """Counts per UTC day from `since` through today, zero-filled and in date order."""
+    first = date.fromisoformat(since[:10])
+    span = (datetime.now(timezone.utc).date() - first).days
+    days = ((first + timedelta(days=i)).isoformat() for i in range(span + 1))
+    return {d: counts.get(d, 0) for d in days}
+
+
+def _page_before(params: dict, before: Optional[str], before_id: Optional[int]) -> None:
+    """
+    Restrict a created_at.desc,id.desc listing to the rows after the cursor
+    (before, before_id) — the created_at and id of the last row already shown.
+    Rows share a created_at (it is written to the second), so the id is what
+    keeps a page boundary inside one second exact.
+    """
+    if not before:
+        return
+    if before_id is None:
+        params["created_at"] = f"lt.{before}"
+        return
+    ts = '"' + before.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    params["or"] = f"(created_at.lt.{ts},and(created_at.eq.{ts},id.lt.{int(before_id)}))"
+
+
+def _coerce_task(value) -> str:
+    """Callback "task" as a display string (n8n may send numbers or null)."""
+    if isinstance(value, str):
+        return value[:120]
+    return "" if value is None else str(value)[:120]
+
+
+def _coerce_progress(value) -> Optional[int]:
+    """Callback "progress" as int, or None when it isn't a number."""
+    if isinstance(value, int):
+        # int(value) so a bool stores 1/0 as the old int() conversion did
+        return int(value)
+    if isinstance(value, float):
+        return int(value) if math.isfinite(value) else None
+    if isinstance(value, str):
+        # int() itself decides: it takes "+5" and " 5 " but rejects "--5" and "²"
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _rows(body: bytes) -> list:
+    """Decode a PostgREST select body; anything but an array of objects becomes []."""
+    data = orjson.loads(body)
+    return data if isinstance(data, list) and (not data or isinstance(data[0], dict)) else []
+
+
+def _settled(results: list, where: str) -> tuple[list, bool]:
+    """
+    Results of gather(..., return_exceptions=True) with each failure logged and
+    replaced by None, so one failed query does not void the others; plus
+    whether any of them failed.
+    """
+    out = []
+    failed = False
+    for r in results:
+        if isinstance(r, BaseException):
+            if not isinstance(r, Exception):
+                raise r
+            logger.error("[Supabase] %s: partial failure: %r", where, r)
+            r = None
+            failed = True
+        out.append(r)
+    return out, failed
+
+
+# Columns of one memory row in get_memory_context output
+_MEMORY_CONTEXT_FIELDS = ("id", "memory_type", "content", "importance", "tags")
+
+# Column lists for scheduled_tasks and quests. The summary list leaves out the
+# result/action_items blobs for callers that only render titles and statuses
+_SCHEDULED_TASK_COLS = (
+    "id,title,horizon,priority,status,result,action_items,review_status,"
+    "assigned_agent,linked_task_id,created_at,updated_at"
+)
+_SCHEDULED_TASK_SUMMARY_COLS = (
+    "id,title,horizon,priority,status,review_status,"
+    "assigned_agent,linked_task_id,created_at,updated_at"
+)
+_QUEST_COLS = (
+    "id,title,description,quest_type,agent,status,data,response,xp_reward,"
+    "created_at,completed_at"
+)
+
+
+# ── Read cache ────────────────────────────────────────────────────────────────
+class TTLLRUCache:
+    """
+    Small LRU with per-entry expiry for getter results.
+
+    Each entry records the tables it was read from, so a write to a table
+    drops every result that depends on it (see SupabaseClient.on_write).
+    Past its TTL an entry is still served for `stale` seconds while the
+    caller refreshes it in the background (stale-while-revalidate).
+    """
+
+    def __init__(self, ttl: float = READ_CACHE_TTL, stale: float = READ_CACHE_STALE,
+                 maxsize: int = READ_CACHE_SIZE):
+        self.ttl = ttl
+        self.stale = stale
+        self.maxsize = maxsize
+        self._data: OrderedDict[tuple, tuple[float, tuple[str, ...], object]] = OrderedDict()
+        # Per-table write counters (plus one bumped by clear()); a result read
+        # before a write to one of its tables is not stored
+        self._generations: dict[str, int] = {}
+        self._epoch = 0
+        # Keys with a background refresh in flight
+        self.refreshing: set[tuple] = set()
+        # Keys with a first load in flight (and the tables it reads); concurrent
+        # misses await the same one
+        self.loading: dict[tuple, tuple[tuple[str, ...], asyncio.Future]] = {}
+
+    def get(self, key: tuple) -> Optional[tuple[object, bool]]:
+        """(value, is_stale) for a usable entry, else None."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        overdue = time.monotonic() - entry[0]
+        if overdue > self.stale:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[2], overdue > 0
+
+    def generation(self, tables: tuple[str, ...]) -> tuple[int, ...]:
+        """Snapshot to pass back to set() once the result for `tables` is read."""
+        return (self._epoch, *(self._generations.get(t, 0) for t in tables))
+
+    def set(self, key: tuple, value, tables: tuple[str, ...], generation: tuple[int, ...],
+            ttl: Optional[float] = None) -> None:
+        if generation != self.generation(tables):
+            return
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), tables, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate_table(self, table: str) -> None:
+        self._generations[table] = self._generations.get(table, 0) + 1
+        stale = [k for k, (_, tables, _) in self._data.items() if table in tables]
+        for k in stale:
+            del self._data[k]
+        # A load started before the write must not be joined by later callers
+        for k in [k for k, (tables, _) in self.loading.items() if table in tables]:
+            del self.loading[k]
+
+    def clear(self) -> None:
+        self._epoch += 1
+        self._data.clear()
+        self.loading.clear()
+
+
+class _Uncached:
+    """Getter result that _cached hands to the caller without storing it."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def _cached(*tables: str, ttl: Optional[float] = None):
+    """
+    Cache a StateManager getter in self._cache; `tables` are the tables it reads.
+
+    `ttl` overrides the cache-wide freshness for this getter. A getter with no
+    tables is never invalidated by writes and only expires. A getter returns
+    _Uncached(value) for results that must not be served again (e.g. partial).
+    """
+    def decorator(fn):
+        name = fn.__name__
+        # Parameters after self, so calls by position or keyword share one flat key
+        params = tuple((p.name, p.default) for p in list(inspect.signature(fn).parameters.values())[1:])
+
+        async def load(self, key: tuple, args: tuple, kwargs: dict):
+            cache = self._cache
+            generation = cache.generation(tables)
+            value = await fn(self, *args, **kwargs)
+            if isinstance(value, _Uncached):
+                return value.value
+            cache.set(key, value, tables, generation, ttl)
+            return value
+
+        async def refresh(self, key: tuple, args: tuple, kwargs: dict) -> None:
+            try:
+                await load(self, key, args, kwargs)
+            finally:
+                self._cache.refreshing.discard(key)
+
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            key = (name, *args, *(kwargs.get(n, d) for n, d in params[len(args):]))
+            cache = self._cache
+            hit = cache.get(key)
+            if hit is None:
+                entry = cache.loading.get(key)
+                if entry is None:
+                    pending = asyncio.ensure_future(load(self, key, args, kwargs))
+                    cache.loading[key] = (tables, pending)
+                    pending.add_done_callback(
+                        lambda f: cache.loading.get(key, (None, None))[1] is f and cache.loading.pop(key))
+                else:
+                    pending = entry[1]
+                return await asyncio.shield(pending)
+            value, is_stale = hit
+            if is_stale and key not in cache.refreshing:
+                cache.refreshing.add(key)
+                if self._spawn(refresh(self, key, args, kwargs)) is None:
+                    cache.refreshing.discard(key)
+            return value
+        return wrapper
+    return decorator
 
 
 # ── State ─────────────────────────────────────────────────────────────────────
-@dataclass
 class AgentState:
-    key:      str
-    id:       int
-    name:     str
-    role:     str
-    emoji:    str
-    color:    str
-    status:   str = "idle"
-    task:     str = "Свободен"
-    progress: int = 0
-    last_status_change: str = ""
+    """
+    Live state of one agent.
+
+    Keeps the wire-format dict (see to_dict) as a snapshot that the status/task/progress
+    setters patch in place, so broadcasts never rebuild it.
+    """
+    __slots__ = (
+        "key", "id", "name", "role", "emoji", "color",
+        "_status", "_task", "_progress", "last_status_change", "_snapshot", "_chat_tpl",
+    )
+
+    def __init__(self, key: str, id: int, name: str, role: str, emoji: str, color: str,
+                 status: str = "idle", task: str = "Свободен", progress: int = 0,
+                 last_status_change: str = ""):
+        self.key   = key
+        self.id    = id
+        self.name  = name
+        self.role  = role
+        self.emoji = emoji
+        self.color = color
+        self._status   = status
+        self._task     = task
+        self._progress = progress
+        self.last_status_change = last_status_change
+        self._snapshot = {
+            "name": key,
+            "emoji": emoji,
+            "color": color,
+            "status": status,
+            "task": task if task != "Свободен" else None,
+            "progress": progress,
+        }
+        # Constant part of every chat message this agent sends
+        self._chat_tpl = {"role": key, "name": name, "emoji": emoji, "color": color}
+
+    @property
+    def status(self) -> str:
+        return self._status
+
+    @status.setter
+    def status(self, value: str) -> None:
+        self._status = value
+        self._snapshot["status"] = value
+
+    @property
+    def task(self) -> str:
+        return self._task
+
+    @task.setter
+    def task(self, value: str) -> None:
+        self._task = value
+        self._snapshot["task"] = value if value != "Свободен" else None
+
+    @property
+    def progress(self) -> int:
+        return self._progress
+
+    @progress.setter
+    def progress(self, value: int) -> None:
+        self._progress = value
+        self._snapshot["progress"] = value
 
     def to_dict(self) -> dict:
-        return {
-            "name": self.key,
-            "emoji": self.emoji,
-            "color": self.color,
-            "status": self.status,
-            "task": self.task if self.task != "Свободен" else None,
-            "progress": self.progress,
-        }
+        # Shared snapshot — callers must not mutate it
+        return self._snapshot
 
 
 # ── Supabase REST helper ──────────────────────────────────────────────────────
+# Per-request Prefer overrides, merged by httpx over the client's default headers
+_PREFER_REPR = {"Prefer": "return=representation"}
+_PREFER_MERGE = {"Prefer": "return=representation,resolution=merge-duplicates"}
+_PREFER_NONE = {"Prefer": ""}
+_PREFER_COUNT = {"Prefer": "count=exact"}
+# Error codes for a table or view that does not exist (PostgREST schema cache, Postgres)
+_MISSING_RELATION = frozenset({"PGRST205", "42P01"})
+
+
+class SupabaseError(Exception):
+    """A PostgREST request answered with an error status."""
+
+    def __init__(self, table: str, status: int, code: Optional[str] = None):
+        super().__init__(f"{table}: HTTP {status}" + (f" ({code})" if code else ""))
+        self.table = table
+        self.status = status
+        # PostgREST error code from the JSON body (e.g. PGRST205: no such table)
+        self.code = code
+
+    @classmethod
+    def from_response(cls, table: str, r: httpx.Response) -> "SupabaseError":
+        try:
+            body = orjson.loads(r.content)
+        except orjson.JSONDecodeError:
+            body = None
+        code = body.get("code") if isinstance(body, dict) else None
+        return cls(table, r.status_code, code if isinstance(code, str) else None)
+
+
 class SupabaseClient:
     def __init__(self, url: str, key: str):
         self.url = url.rstrip("/")
@@ -56,133 +479,477 @@ class SupabaseClient:
             "Content-Type": "application/json",
             "Prefer": "return=minimal",
         }
+        # One pooled client for the process lifetime: keep-alive instead of a
+        # TCP+TLS handshake per REST call, and HTTP/2 so gathered selects
+        # multiplex over one connection. Closed via aclose() on app shutdown.
+        self._client = httpx.AsyncClient(
+            base_url=f"{self.url}/rest/v1",
+            headers=self.headers,
+            http2=True,
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=SUPABASE_MAX_CONNECTIONS,
+                max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                keepalive_expiry=60,
+            ),
+        )
+        # (table, params) → (etag, raw body) for conditional GETs; the body is
+        # re-decoded on a hit because callers may reshape the rows they get
+        self._etags: OrderedDict[tuple, tuple[str, bytes]] = OrderedDict()
+        # Called with the table name after every write (StateManager drops cached reads)
+        self.on_write: Optional[Callable[[str], None]] = None
+        # (table, id, columns) → (expires, row) for select_by_id
+        self._by_id: dict[tuple[str, str, str], tuple[float, dict]] = {}
+        # queue_insert buffers: table → [(row, future)], plus one flusher task per table
+        self._insert_pending: dict[str, list[tuple[dict, asyncio.Future]]] = {}
+        self._insert_tasks: dict[str, asyncio.Task] = {}
+        # queue_update/queue_delete buffers: (method, table) → [(id, data, future)]
+        self._write_pending: dict[tuple[str, str], list[tuple[int, Optional[dict], asyncio.Future]]] = {}
+        self._write_tasks: dict[tuple[str, str], asyncio.Task] = {}
+
+    def _written(self, table: str, match: Optional[dict] = None) -> None:
+        """Drop cached reads of `table`; only the matched row when `match` is by id."""
+        if self._by_id:
+            row_id = str(match["id"]) if match and "id" in match else None
+            stale = [k for k in self._by_id if k[0] == table and (row_id is None or k[1] == row_id)]
+            for k in stale:
+                del self._by_id[k]
+        if self.on_write is not None:
+            self.on_write(table)
+
+    def pool_stats(self) -> dict:
+        """Open/idle connection counts of the underlying pool (empty if not introspectable)."""
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return {}
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "connections": len(connections),
+            "active": len(connections) - idle,
+            "idle": idle,
+            "max_connections": SUPABASE_MAX_CONNECTIONS,
+            "max_keepalive": SUPABASE_MAX_KEEPALIVE,
+        }
 
-    async def insert(self, table: str, data: dict) -> None:
-        async with httpx.AsyncClient(timeout=10) as client:
-            await client.post(
-                f"{self.url}/rest/v1/{table}",
-                headers=self.headers,
-                json=data,
-            )
+    async def aclose(self) -> None:
+        if self._insert_tasks or self._write_tasks:
+            await asyncio.gather(*self._insert_tasks.values(), *self._write_tasks.values(),
+                                 return_exceptions=True)
+        await self._client.aclose()
+
+    # Bodies are encoded/decoded with orjson rather than httpx's stdlib json;
+    # Content-Type is already set on the client headers.
+
+    async def insert(self, table: str, data: dict | list[dict]) -> None:
+        """Insert one row, or many in a single request when given a list."""
+        await self._client.post(f"/{table}", content=orjson.dumps(data))
+        self._written(table)
+
+    async def insert_returning(self, table: str, data: dict | list[dict]) -> list:
+        r = await self._client.post(
+            f"/{table}",
+            headers=_PREFER_REPR,
+            content=orjson.dumps(data),
+        )
+        self._written(table)
+        if r.status_code in (200, 201):
+            return orjson.loads(r.content)
+        logger.error("[Supabase] INSERT %s → %s: %s", table, r.status_code, r.text[:300])
+        return []
+
+    async def queue_insert(self, table: str, row: dict) -> Optional[dict]:
+        """
+        Insert one row and return it, sharing the request with other rows queued
+        for the same table within INSERT_MERGE_WINDOW.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        self._insert_pending.setdefault(table, []).append((row, fut))
+        if table not in self._insert_tasks:
+            self._insert_tasks[table] = asyncio.create_task(self._flush_inserts(table))
+        return await fut
 
-    async def insert_returning(self, table: str, data: dict) -> list:
-        async with httpx.AsyncClient(timeout=10) as client:
-            r = await client.post(
-                f"{self.url}/rest/v1/{table}",
-                headers={**self.headers, "Prefer": "return=representation"},
-                json=data,
-            )
-            if r.status_code in (200, 201):
-                return r.json()
-            import logging
-            logging.getLogger("agent-office").error(
-                f"[Supabase] INSERT {table} → {r.status_code}: {r.text[:300]}"
+    async def _flush_inserts(self, table: str) -> None:
+        try:
+            await asyncio.sleep(INSERT_MERGE_WINDOW)
+            while pending := self._insert_pending.pop(table, None):
+                for i in range(0, len(pending), INSERT_MERGE_LIMIT):
+                    await self._insert_chunk(table, pending[i:i + INSERT_MERGE_LIMIT])
+        finally:
+            self._insert_tasks.pop(table, None)
+
+    async def _insert_chunk(self, table: str, items: list[tuple[dict, asyncio.Future]]) -> None:
+        # PostgREST bulk inserts need identical keys in every object, so rows
+        # with optional columns go out as separate requests
+        groups: dict[tuple, list[tuple[dict, asyncio.Future]]] = {}
+        for item in items:
+            groups.setdefault(tuple(item[0]), []).append(item)
+        for group in groups.values():
+            try:
+                rows = await self.insert_returning(table, [row for row, _ in group])
+            except Exception as e:
+                for _, fut in group:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            # Representation rows come back in insert order
+            for i, (_, fut) in enumerate(group):
+                if not fut.done():
+                    fut.set_result(rows[i] if i < len(rows) else None)
+
+    async def queue_update(self, table: str, row_id: int, data: dict) -> None:
+        """
+        PATCH one row by id. Identical updates to other rows of `table` queued
+        within WRITE_MERGE_WINDOW go out as one `id=in.(...)` request.
+        """
+        await self._queue_write("PATCH", table, row_id, data)
+
+    async def queue_delete(self, table: str, row_id: int) -> None:
+        """DELETE one row by id, merged with other deletes from `table` like queue_update."""
+        await self._queue_write("DELETE", table, row_id, None)
+
+    async def _queue_write(self, method: str, table: str, row_id: int, data: Optional[dict]) -> None:
+        key = (method, table)
+        fut = asyncio.get_running_loop().create_future()
+        self._write_pending.setdefault(key, []).append((row_id, data, fut))
+        if key not in self._write_tasks:
+            self._write_tasks[key] = asyncio.create_task(self._flush_writes(key))
+        await fut
+
+    async def _flush_writes(self, key: tuple[str, str]) -> None:
+        method, table = key
+        try:
+            await asyncio.sleep(WRITE_MERGE_WINDOW)
+            while pending := self._write_pending.pop(key, None):
+                # One request per distinct body; PATCH applies the same body to every matched row
+                groups: dict[Optional[bytes], list[tuple[int, asyncio.Future]]] = {}
+                for row_id, data, fut in pending:
+                    body = orjson.dumps(data) if data is not None else None
+                    groups.setdefault(body, []).append((row_id, fut))
+                for body, items in groups.items():
+                    for i in range(0, len(items), WRITE_MERGE_LIMIT):
+                        await self._write_chunk(method, table, body, items[i:i + WRITE_MERGE_LIMIT])
+        finally:
+            self._write_tasks.pop(key, None)
+
+    async def _write_chunk(self, method: str, table: str, body: Optional[bytes],
+                           items: list[tuple[int, asyncio.Future]]) -> None:
+        ids = dict.fromkeys(row_id for row_id, _ in items)
+        try:
+            await self._client.request(
+                method, f"/{table}",
+                params={"id": f"in.({','.join(map(str, ids))})"},
+                content=body,
             )
+        except Exception as e:
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self._written(table, {"id": next(iter(ids))} if len(ids) == 1 else None)
+        for _, fut in items:
+            if not fut.done():
+                fut.set_result(None)
+
+    async def select(self, table: str, params: dict, strict: bool = False) -> list:
+        """
+        GET rows. When the server sent an ETag for the same query before, it is
+        replayed as If-None-Match and a 304 re-decodes the remembered body.
+
+        An error response reads as [] unless `strict`, which raises SupabaseError
+        instead, for callers that must tell a failure from an empty result.
+        """
+        key = (table, tuple(params.items()))
+        cached = self._etags.get(key)
+        headers = _PREFER_NONE if cached is None else {"Prefer": "", "If-None-Match": cached[0]}
+        r = await self._client.get(f"/{table}", headers=headers, params=params)
+        if r.status_code == 304 and cached is not None:
+            self._etags.move_to_end(key)
+            return _rows(cached[1])
+        if r.status_code != 200:
+            if strict:
+                raise SupabaseError.from_response(table, r)
             return []
+        etag = r.headers.get("etag")
+        if etag:
+            self._etags[key] = (etag, r.content)
+            self._etags.move_to_end(key)
+            if len(self._etags) > ETAG_CACHE_SIZE:
+                self._etags.popitem(last=False)
+        elif cached is not None:
+            del self._etags[key]
+        return _rows(r.content)
+
+    async def select_stream(self, table: str, params: dict, page: int = STREAM_PAGE_SIZE,
+                            max_rows: int = STREAM_MAX_ROWS, strict: bool = False) -> AsyncIterator[list]:
+        """Yield `table` rows page by page (limit/offset, stable id order), at most `max_rows`."""
+        params = {"order": "id.asc", **params, "limit": str(page)}
+        offset = 0
+        while offset < max_rows:
+            rows = await self.select(table, {**params, "offset": str(offset)}, strict)
+            if rows:
+                yield rows
+            if len(rows) < page:
+                return
+            offset += page
+
+    async def rpc(self, fn: str, args: dict) -> Optional[list]:
+        """Call a Postgres function; None when it failed (e.g. not created yet)."""
+        r = await self._client.post(f"/rpc/{fn}", headers=_PREFER_NONE, content=orjson.dumps(args))
+        return _rows(r.content) if r.status_code == 200 else None
+
+    async def select_by_id(self, table: str, row_id: int, columns: str) -> Optional[dict]:
+        """One row by primary key, cached for BY_ID_CACHE_TTL; None if not found."""
+        key = (table, str(row_id), columns)
+        hit = self._by_id.get(key)
+        if hit is not None and hit[0] > time.monotonic():
+            return dict(hit[1])
+        rows = await self.select(table, {"select": columns, "id": f"eq.{row_id}"})
+        if not rows:
+            return None
+        if len(self._by_id) >= BY_ID_CACHE_SIZE:
+            del self._by_id[next(iter(self._by_id))]
+        self._by_id[key] = (time.monotonic() + BY_ID_CACHE_TTL, rows[0])
+        return dict(rows[0])
 
-    async def select(self, table: str, params: dict) -> list:
-        async with httpx.AsyncClient(timeout=10) as client:
-            r = await client.get(
-                f"{self.url}/rest/v1/{table}",
-                headers={**self.headers, "Prefer": ""},
-                params=params,
-            )
-            return r.json() if r.status_code == 200 else []
+    async def count(self, table: str, params: dict) -> int:
+        """
+        Number of rows matching `params`, via HEAD + Content-Range (no row payload).
+        Raises SupabaseError on an error response, so a failure is not read as 0.
+        """
+        r = await self._client.head(f"/{table}", headers=_PREFER_COUNT, params=params)
+        if r.status_code not in (200, 206):
+            raise SupabaseError.from_response(table, r)
+        total = r.headers.get("content-range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else 0
 
     async def update(self, table: str, match: dict, data: dict) -> None:
         params = {k: f"eq.{v}" for k, v in match.items()}
-        async with httpx.AsyncClient(timeout=10) as client:
-            await client.patch(
-                f"{self.url}/rest/v1/{table}",
-                headers=self.headers,
-                params=params,
-                json=data,
-            )
+        await self._client.patch(f"/{table}", params=params, content=orjson.dumps(data))
+        self._written(table, match)
+
+    async def update_returning(self, table: str, match: dict, data: dict, select: str = "*") -> list:
+        """PATCH and get the updated rows back in the same round-trip."""
+        params = {k: f"eq.{v}" for k, v in match.items()}
+        params["select"] = select
+        r = await self._client.patch(
+            f"/{table}",
+            headers=_PREFER_REPR,
+            params=params,
+            content=orjson.dumps(data),
+        )
+        self._written(table, match)
+        return orjson.loads(r.content) if r.status_code == 200 else []
 
     async def upsert(self, table: str, data: dict, on_conflict: str = "") -> list:
-        headers = {**self.headers, "Prefer": "return=representation,resolution=merge-duplicates"}
-        async with httpx.AsyncClient(timeout=10) as client:
-            r = await client.post(
-                f"{self.url}/rest/v1/{table}",
-                headers=headers,
-                json=data,
-            )
-            return r.json() if r.status_code in (200, 201) else []
+        r = await self._client.post(
+            f"/{table}",
+            headers=_PREFER_MERGE,
+            content=orjson.dumps(data),
+        )
+        self._written(table)
+        return orjson.loads(r.content) if r.status_code in (200, 201) else []
 
     async def delete(self, table: str, match: dict) -> None:
         params = {k: f"eq.{v}" for k, v in match.items()}
-        async with httpx.AsyncClient(timeout=10) as client:
-            await client.delete(
-                f"{self.url}/rest/v1/{table}",
-                headers=self.headers,
-                params=params,
-            )
+        await self._client.delete(f"/{table}", params=params)
+        self._written(table, match)
 
 
 # ── State manager ─────────────────────────────────────────────────────────────
 class StateManager:
     def __init__(self, supabase_url: Optional[str] = None, supabase_key: Optional[str] = None):
-        self.agents: dict[str, AgentState] = {
-            k: AgentState(key=k, **v) for k, v in AGENT_DEFS.items()
-        }
-        self.history: list[dict] = []
+        # Fixed agent roster: tuple for iteration, key → index for lookup.
+        # self.agents is the same objects keyed by name for external callers.
+        self._agent_tuple: tuple[AgentState, ...] = tuple(
+            AgentState(*t) for t in _AGENT_TEMPLATES
+        )
+        self._agent_idx: dict[str, int] = {a.key: i for i, a in enumerate(self._agent_tuple)}
+        self.agents: dict[str, AgentState] = {a.key: a for a in self._agent_tuple}
+        # Chat messages, stored pre-encoded as JSON so WS replay never re-serializes them
+        self.history: deque[bytes] = deque(maxlen=HISTORY_LIMIT)
+        # History is pulled from Supabase on first use (see ensure_history)
+        self._history_loaded = False
+        self._history_lock = asyncio.Lock()
+        # After a failed load, callers skip loading until this monotonic time
+        self._history_retry_at = 0.0
         self._current_task_id: Optional[int] = None
         self._current_idea_id: Optional[int] = None
 
+        # Pending WS events, flushed together after the batch window (see _enqueue)
+        self._pending: list[dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        # Agents with an agent_update already in _pending (its snapshot is live)
+        self._pending_agents: set[str] = set()
+        # Per-agent agent_update rate limit (see _push_agent_update)
+        self._last_update: dict[str, float] = {}
+        self._update_timers: dict[str, asyncio.TimerHandle] = {}
+
+        # (table, row) pairs of chat/diary rows waiting to be bulk-inserted (see _message_writer)
+        self._msg_queue: asyncio.Queue[tuple[str, dict]] = asyncio.Queue(maxsize=MESSAGE_QUEUE_MAX)
+        self._writer_task: Optional[asyncio.Task] = None
+        # Strong refs to fire-and-forget tasks (see _spawn) so they are not GC'd mid-flight
+        self._bg_tasks: set[asyncio.Task] = set()
+        # Caps how many of them run at once; the rest wait their turn
+        self._bg_slots = asyncio.Semaphore(BACKGROUND_CONCURRENCY)
+
+        # Short-lived cache over read-only getters, dropped per table on writes
+        self._cache = TTLLRUCache()
+        # Warm copies of system memories / user profile for get_memory_context
+        self._warm_system: list = []
+        self._warm_prefs: list = []
+        self._warm_until = 0.0
+
         self.db: Optional[SupabaseClient] = None
         if supabase_url and supabase_key:
             self.db = SupabaseClient(supabase_url, supabase_key)
-            print("[Supabase] client configured")
+            self.db.on_write = self._on_db_write
+            logger.info("[Supabase] client configured")
         else:
-            print("[Supabase] not configured — in-memory only")
+            logger.info("[Supabase] not configured — in-memory only")
 
     # ── Load from DB on startup ───────────────────────────────────────────────
 
-    async def load_history(self) -> None:
-        """Load last 100 messages from Supabase into memory."""
-        if not self.db:
+    async def ensure_history(self) -> None:
+        """Load history from Supabase once, on first demand rather than at startup."""
+        if self._history_loaded or time.monotonic() < self._history_retry_at:
             return
+        async with self._history_lock:
+            # Callers that queued behind a failed load do not each retry it
+            if self._history_loaded or time.monotonic() < self._history_retry_at:
+                return
+            self._history_loaded = await self.load_history()
+            if not self._history_loaded:
+                self._history_retry_at = time.monotonic() + HISTORY_RETRY_DELAY
+
+    async def load_history(self) -> bool:
+        """Load last 100 messages from Supabase into memory; False if the load failed."""
+        if not self.db:
+            return True
         try:
             rows = await self.db.select("messages", {
                 "select": "role,name,emoji,color,content,msg_time",
-                "order": "created_at.asc",
+                # id breaks ties: a bulk insert gives its rows one created_at
+                "order": "created_at.desc,id.desc",
                 "limit": "100",
             })
-            self.history = [
-                {
+            # Newest 100 come back newest-first; history runs oldest to newest
+            rows.reverse()
+            stored = [
+                orjson.dumps({
                     "role":    r["role"],
                     "name":    r.get("name") or "",
                     "emoji":   r.get("emoji") or "",
                     "color":   r.get("color") or "",
                     "content": r["content"],
                     "time":    r.get("msg_time") or "",
-                }
+                })
                 for r in rows
-                if isinstance(r, dict)
             ]
-            print(f"[Supabase] loaded {len(self.history)} messages from DB")
-        except Exception as e:
-            print(f"[Supabase] load_history error: {e}")
+            # Messages that arrived before the load stay after the stored ones.
+            # Those the writer already saved are also the newest stored rows,
+            # so the longest stored tail equal to the in-memory head is skipped
+            live = list(self.history)
+            overlap = next(
+                (k for k in range(min(len(stored), len(live)), 0, -1) if stored[-k:] == live[:k]), 0,
+            )
+            self.history = deque(chain(stored, islice(live, overlap, None)), maxlen=HISTORY_LIMIT)
+            logger.info("[Supabase] loaded %d messages from DB", len(self.history))
+            return True
+        except Exception:
+            logger.exception("[Supabase] load_history error")
+            return False
 
-    # ── Save message fire-and-forget ──────────────────────────────────────────
+    # ── Save message fire-and-forget (batched) ────────────────────────────────
 
     def _save_message(self, msg: dict) -> None:
         if not self.db:
             return
-        asyncio.create_task(self._do_save_message(msg))
-
-    async def _do_save_message(self, msg: dict) -> None:
+        self._queue_row("messages", {
+            "role":     msg["role"],
+            "name":     msg.get("name", ""),
+            "emoji":    msg.get("emoji", ""),
+            "color":    msg.get("color", ""),
+            "content":  msg["content"],
+            "msg_time": msg.get("time", ""),
+        })
+
+    def _queue_row(self, table: str, row: dict) -> None:
         try:
-            await self.db.insert("messages", {
-                "role":     msg["role"],
-                "name":     msg.get("name", ""),
-                "emoji":    msg.get("emoji", ""),
-                "color":    msg.get("color", ""),
-                "content":  msg["content"],
-                "msg_time": msg.get("time", ""),
-            })
-        except Exception as e:
-            print(f"[Supabase] save_message error: {e}")
+            self._msg_queue.put_nowait((table, row))
+        except asyncio.QueueFull:
+            logger.warning("[Supabase] write queue full (%d), dropping %s row", MESSAGE_QUEUE_MAX, table)
+        # Started lazily: StateManager is built at import time, outside the event loop
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._message_writer())
+
+    async def _message_writer(self) -> None:
+        """Drain queued rows into bulk inserts (one per table) of up to MESSAGE_BATCH_SIZE rows."""
+        queue = self._msg_queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + MESSAGE_BATCH_WINDOW
+            while len(batch) < MESSAGE_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            by_table: dict[str, list[dict]] = {}
+            for table, row in batch:
+                by_table.setdefault(table, []).append(row)
+            for table, rows in by_table.items():
+                try:
+                    await self.db.insert(table, rows)
+                except Exception:
+                    logger.exception("[Supabase] save %s error (%d rows)", table, len(rows))
+            for _ in batch:
+                queue.task_done()
+
+    def _on_db_write(self, table: str) -> None:
+        self._cache.invalidate_table(table)
+        if table in ("agent_memory", "user_profile"):
+            self._warm_until = 0.0
+
+    async def _run_slotted(self, coro):
+        async with self._bg_slots:
+            return await coro
+
+    def _spawn(self, coro) -> Optional[asyncio.Task]:
+        """
+        Run a coroutine in the background, keeping it referenced until it finishes.
+        At most BACKGROUND_CONCURRENCY of them run at a time; with
+        BACKGROUND_TASKS_MAX already held the coroutine is dropped and None returned.
+        """
+        if len(self._bg_tasks) >= BACKGROUND_TASKS_MAX:
+            logger.warning("[Supabase] %d background tasks pending, dropping %s",
+                           len(self._bg_tasks), getattr(coro, "__qualname__", coro))
+            coro.close()
+            return None
+        task = asyncio.create_task(self._run_slotted(coro))
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_tasks.discard)
+        return task
+
+    async def aclose(self, timeout: float = 5.0) -> None:
+        """Shutdown: finish background DB work and queued chat rows, then close the client."""
+        for timer in self._update_timers.values():
+            timer.cancel()
+        self._update_timers.clear()
+        if self._bg_tasks:
+            await asyncio.wait(self._bg_tasks, timeout=timeout)
+        if self._writer_task is not None:
+            try:
+                await asyncio.wait_for(self._msg_queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("[Supabase] %d rows not saved on shutdown", self._msg_queue.qsize())
+            self._writer_task.cancel()
+            self._writer_task = None
+        if self.db:
+            await self.db.aclose()
 
     # ── Task tracking ─────────────────────────────────────────────────────────
 
@@ -197,8 +964,8 @@ class StateManager:
             })
             if rows:
                 return rows[0].get("id")
-        except Exception as e:
-            print(f"[Supabase] save_task error: {e}")
+        except Exception:
+            logger.exception("[Supabase] save_task error")
         return None
 
     async def finish_task(self, task_id: int, summary: str = "") -> None:
@@ -208,10 +975,10 @@ class StateManager:
             # Only update status/finished_at — summary will be set by main.py with full result
             await self.db.update("tasks", {"id": task_id}, {
                 "status": "done",
-                "finished_at": datetime.utcnow().isoformat(),
+                "finished_at": _utc_iso(),
             })
-        except Exception as e:
-            print(f"[Supabase] finish_task error: {e}")
+        except Exception:
+            logger.exception("[Supabase] finish_task error")
 
     async def _finish_latest_processing(self, summary: str = "") -> None:
         """Fallback: mark the most recent 'processing' task done when task_id was lost."""
@@ -222,11 +989,12 @@ class StateManager:
                 "order": "created_at.desc",
                 "limit": "1",
             })
-            if rows and isinstance(rows, list) and rows[0].get("id"):
+            if rows and rows[0].get("id"):
                 await self.finish_task(rows[0]["id"], summary)
-        except Exception as e:
-            print(f"[Supabase] _finish_latest_processing error: {e}")
+        except Exception:
+            logger.exception("[Supabase] _finish_latest_processing error")
 
+    @_cached("tasks")
     async def get_tasks(self, limit: int = 50) -> list:
         if not self.db:
             return []
@@ -236,31 +1004,88 @@ class StateManager:
                 "order": "created_at.desc",
                 "limit": str(limit),
             })
-        except Exception as e:
-            print(f"[Supabase] get_tasks error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_tasks error")
             return []
 
     async def get_agent_task_by_id(self, task_id: int) -> Optional[dict]:
         if not self.db:
             return None
         try:
-            rows = await self.db.select("tasks", {
-                "select": "id,created_at,content,status,summary,finished_at,assigned_agent,priority,tags",
-                "id": f"eq.{task_id}",
-            })
-            return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] get_agent_task_by_id error: {e}")
+            return await self.db.select_by_id(
+                "tasks", task_id,
+                "id,created_at,content,status,summary,finished_at,assigned_agent,priority,tags",
+            )
+        except Exception:
+            logger.exception("[Supabase] get_agent_task_by_id error")
             return None
 
+    # ── Batched broadcast ─────────────────────────────────────────────────────
+
+    def _enqueue(self, broadcast: Callable, event: dict) -> None:
+        """Queue a WS event; events queued within the batch window are flushed together."""
+        self._pending.append(event)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush(broadcast))
+
+    def _push_agent_update(self, broadcast: Callable, agent: AgentState, force: bool = False) -> None:
+        """Queue an agent_update, at most one per AGENT_UPDATE_INTERVAL per agent.
+
+        A suppressed update arms a timer that sends the agent's latest snapshot
+        once the interval has elapsed; `force` sends immediately.
+        """
+        key = agent.key
+        now = time.monotonic()
+        wait = AGENT_UPDATE_INTERVAL - (now - self._last_update.get(key, 0.0))
+        if force or wait <= 0:
+            timer = self._update_timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            self._last_update[key] = now
+            if key not in self._pending_agents:
+                self._pending_agents.add(key)
+                self._enqueue(broadcast, {"type": "agent_update", "agent": agent.to_dict()})
+        elif key not in self._update_timers:
+            self._update_timers[key] = asyncio.get_running_loop().call_later(
+                wait, self._push_delayed_update, broadcast, agent,
+            )
+
+    def _push_delayed_update(self, broadcast: Callable, agent: AgentState) -> None:
+        self._update_timers.pop(agent.key, None)
+        self._push_agent_update(broadcast, agent, force=True)
+
+    async def _flush(self, broadcast: Callable) -> None:
+        try:
+            while self._pending:
+                await asyncio.sleep(BROADCAST_BATCH_WINDOW)
+                msgs, self._pending = self._pending, []
+                self._pending_agents.clear()
+                # Each event keeps its own plain frame: the dashboard only understands
+                # agent_update/chat/tasks_update, so there is no batch envelope
+                for msg in msgs:
+                    await broadcast(msg)
+        except Exception:
+            logger.exception("[broadcast] flush error")
+        finally:
+            self._flush_task = None
+
     # ── Public API ────────────────────────────────────────────────────────────
 
     def agent_states(self) -> list[dict]:
-        return [a.to_dict() for a in self.agents.values()]
+        return [a.to_dict() for a in self._agent_tuple]
+
+    def recent_history_json(self, limit: int = 80) -> bytes:
+        """Last `limit` chat messages as an encoded JSON array."""
+        start = max(0, len(self.history) - limit)
+        return b"[" + b",".join(islice(self.history, start, None)) + b"]"
 
     async def apply_callback(self, broadcast: Callable, payload: dict):
         """
         Process a callback from n8n and broadcast updates to all WS clients.
+        Updates are coalesced: events queued within BROADCAST_BATCH_WINDOW are
+        flushed together (an agent queued twice sends one agent_update with its
+        latest state), and agent_update is rate-limited per agent to one per
+        AGENT_UPDATE_INTERVAL (terminal statuses are always sent at once).
 
         Expected payload fields:
           agent    — agent key (manager|researcher|writer|coder|analyst)
@@ -269,68 +1094,72 @@ class StateManager:
           progress — 0-100 (optional)
           message  — chat message to display (optional)
         """
-        key = payload.get("agent", "")
-        if key not in self.agents:
+        key = payload.get("agent")
+        if key not in AGENT_KEYS:
             return
 
-        agent = self.agents[key]
+        agent = self._agent_tuple[self._agent_idx[key]]
+        # Single pass over the payload: each field is looked up and normalised once
+        status = payload.get("status")
+        task = payload.get("task")
+        progress = _coerce_progress(payload["progress"]) if "progress" in payload else None
+        msg_text = payload.get("message")
+        msg_text = msg_text.strip() if isinstance(msg_text, str) else ""
 
+        before = (agent.status, agent.task, agent.progress)
         if "status" in payload:
-            agent.status = payload["status"]
-            from datetime import datetime
-            agent.last_status_change = datetime.utcnow().isoformat()
+            agent.status = _STATUSES.get(status, status) if isinstance(status, str) else status
+            # Every status callback counts as activity for the monitor's stuck check
+            agent.last_status_change = datetime.now(timezone.utc).isoformat()
         if "task" in payload:
-            agent.task = payload["task"][:120]
-        if "progress" in payload:
-            try:
-                agent.progress = int(payload["progress"])
-            except (ValueError, TypeError):
-                pass
-
-        await broadcast({"type": "agent_update", "agent": agent.to_dict()})
-
-        if payload.get("message", "").strip():
+            agent.task = _coerce_task(task)
+        if progress is not None:
+            agent.progress = progress
+
+        # Chat-only callbacks and re-sent states (n8n repeats status=working)
+        # change nothing, so no agent_update goes out for them
+        if (agent.status, agent.task, agent.progress) != before:
+            # Malformed payloads may carry a non-string (even unhashable) status
+            terminal = isinstance(agent.status, str) and agent.status in _FLUSH_STATUSES
+            self._push_agent_update(broadcast, agent, force=terminal)
+
+        if msg_text:
             msg = {
-                "role":    key,
-                "name":    agent.name,
-                "emoji":   agent.emoji,
-                "color":   agent.color,
-                "content": payload["message"].strip(),
-                "time":    datetime.now().strftime("%H:%M"),
+                **agent._chat_tpl,
+                "content": msg_text,
+                "time":    _now_hm(),
             }
-            self.history.append(msg)
-            if len(self.history) > 200:
-                self.history.pop(0)
+            self.history.append(orjson.dumps(msg))
             self._save_message(msg)
-            await broadcast({"type": "chat", "message": msg})
+            self._enqueue(broadcast, {"type": "chat", "message": msg})
 
         # Use taskId from payload if available (fixes race condition with concurrent tasks)
         task_id = payload.get("taskId") or self._current_task_id
 
         # Handle error status from agents
-        if payload.get("status") == "error" and task_id and self.db:
+        if status == "error" and task_id and self.db:
+            # The raw message, as stored before: an empty one leaves "Agent error: "
             error_msg = payload.get("message", "Unknown error")
             try:
                 await self.db.update("tasks", {"id": task_id}, {
                     "status": "error",
                     "summary": f"Agent error: {error_msg[:500]}",
                 })
-            except Exception as e:
-                print(f"[apply_callback] error marking task {task_id} as error: {e}")
-            await broadcast({"type": "tasks_update"})
+            except Exception:
+                logger.exception("[apply_callback] error marking task %s as error", task_id)
+            self._enqueue(broadcast, {"type": "tasks_update"})
 
         # When manager goes idle, mark current task and idea as done
-        if key == "manager" and payload.get("status") == "idle":
+        if key == "manager" and status == "idle":
             self._current_task_id = None
-            summary = payload.get("message", "")
             if task_id:
-                asyncio.create_task(self.finish_task(task_id, summary))
+                self._spawn(self.finish_task(task_id, msg_text))
             elif self.db:
-                asyncio.create_task(self._finish_latest_processing(summary))
+                self._spawn(self._finish_latest_processing(msg_text))
             idea_id = self._current_idea_id
             self._current_idea_id = None
             if idea_id:
-                asyncio.create_task(self.finish_idea(idea_id, summary))
+                self._spawn(self.finish_idea(idea_id, msg_text))
 
     # ── Ideas board (Supabase) ─────────────────────────────────────────────────
 
@@ -343,8 +1172,8 @@ class StateManager:
                 "status": "planning",
             })
             return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] create_idea error: {e}")
+        except Exception:
+            logger.exception("[Supabase] create_idea error")
             return None
 
     async def update_idea_plan(self, idea_id: int, plan_text: str) -> None:
@@ -355,21 +1184,20 @@ class StateManager:
                 "status": "planned",
                 "plan_text": plan_text,
             })
-        except Exception as e:
-            print(f"[Supabase] update_idea_plan error: {e}")
+        except Exception:
+            logger.exception("[Supabase] update_idea_plan error")
 
     async def start_idea(self, idea_id: int) -> Optional[dict]:
         if not self.db:
             return None
         try:
-            await self.db.update("ideas", {"id": idea_id}, {"status": "active"})
-            rows = await self.db.select("ideas", {
-                "select": "id,content,status,plan_text,result,created_at",
-                "id": f"eq.{idea_id}",
-            })
+            rows = await self.db.update_returning(
+                "ideas", {"id": idea_id}, {"status": "active"},
+                select="id,content,status,plan_text,result,created_at",
+            )
             return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] start_idea error: {e}")
+        except Exception:
+            logger.exception("[Supabase] start_idea error")
             return None
 
     async def finish_idea(self, idea_id: int, result: str = "") -> None:
@@ -380,9 +1208,10 @@ class StateManager:
                 "status": "done",
                 "result": result[:300] if result else "",
             })
-        except Exception as e:
-            print(f"[Supabase] finish_idea error: {e}")
+        except Exception:
+            logger.exception("[Supabase] finish_idea error")
 
+    @_cached("ideas")
     async def get_ideas(self, limit: int = 50) -> list:
         if not self.db:
             return []
@@ -392,8 +1221,8 @@ class StateManager:
                 "order": "created_at.desc",
                 "limit": str(limit),
             })
-        except Exception as e:
-            print(f"[Supabase] get_ideas error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_ideas error")
             return []
 
     # ── Articles (Supabase, RSS for Яндекс Дзен) ─────────────────────────────
@@ -407,10 +1236,11 @@ class StateManager:
                 "content": content,
             })
             return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] save_article error: {e}")
+        except Exception:
+            logger.exception("[Supabase] save_article error")
             return None
 
+    @_cached("articles")
     async def get_articles(self, limit: int = 50) -> list:
         if not self.db:
             return []
@@ -420,21 +1250,19 @@ class StateManager:
                 "order": "created_at.desc",
                 "limit": str(limit),
             })
-        except Exception as e:
-            print(f"[Supabase] get_articles error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_articles error")
             return []
 
     async def get_article_by_id(self, article_id: int) -> Optional[dict]:
         if not self.db:
             return None
         try:
-            rows = await self.db.select("articles", {
-                "select": "id,title,content,published_url,created_at",
-                "id": f"eq.{article_id}",
-            })
-            return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] get_article_by_id error: {e}")
+            return await self.db.select_by_id(
+                "articles", article_id, "id,title,content,published_url,created_at",
+            )
+        except Exception:
+            logger.exception("[Supabase] get_article_by_id error")
             return None
 
     # ── Agent Memory ──────────────────────────────────────────────────────────
@@ -454,12 +1282,12 @@ class StateManager:
             }
             if source_task_id:
                 data["source_task_id"] = source_task_id
-            rows = await self.db.insert_returning("agent_memory", data)
-            return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] save_memory error: {e}")
+            return await self.db.queue_insert("agent_memory", data)
+        except Exception:
+            logger.exception("[Supabase] save_memory error")
             return None
 
+    @_cached("agent_memory")
     async def get_memory(self, agent: Optional[str] = None,
                          memory_type: Optional[str] = None,
                          limit: int = 50) -> list:
@@ -476,47 +1304,44 @@ class StateManager:
             if memory_type:
                 params["memory_type"] = f"eq.{memory_type}"
             return await self.db.select("agent_memory", params)
-        except Exception as e:
-            print(f"[Supabase] get_memory error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_memory error")
             return []
 
+    @_cached("agent_memory", "user_profile")
     async def get_memory_context(self, agent: str, limit: int = 20) -> list:
         """Top memories for an agent: system map + own lessons + shared high-importance + user prefs."""
         if not self.db:
             return []
         try:
-            system_mem, own, shared, prefs = await asyncio.gather(
-                # System memories (ecosystem map, global anti-patterns) — always first
-                self.db.select("agent_memory", {
-                    "select": "id,memory_type,content,importance,tags",
-                    "agent": "eq.system",
-                    "order": "importance.desc",
-                    "limit": "5",
-                }),
-                self.db.select("agent_memory", {
-                    "select": "id,memory_type,content,importance,tags",
-                    "agent": f"eq.{agent}",
-                    "order": "importance.desc,created_at.desc",
-                    "limit": str(min(limit, 15)),
-                }),
-                self.db.select("agent_memory", {
-                    "select": "id,memory_type,content,importance,tags,agent",
-                    "agent": f"neq.{agent}",
-                    "importance": "gte.8",
-                    "order": "importance.desc,created_at.desc",
-                    "limit": "5",
-                }),
-                self.db.select("user_profile", {
-                    "select": "category,key,value",
-                    "order": "category.asc",
-                }),
-            )
-            # Filter out system from shared
-            shared = [m for m in shared if m.get("agent") != "system"]
-            # Tag shared lessons
+            # One round-trip via migrations/002_memory_context_rpc.sql; falls back
+            # to four selects while the function is not deployed
+            rows = await self.db.rpc("get_memory_context", {"p_agent": agent, "lim": limit})
+            if rows is None:
+                system_mem, own, shared, prefs = await self._memory_context_selects(agent, limit)
+            else:
+                system_mem, own, shared, prefs = [], [], [], []
+                for r in rows:
+                    bucket = r.get("bucket")
+                    if bucket == "prefs":
+                        prefs.append({"category": r["category"], "key": r["key"], "value": r["value"]})
+                        continue
+                    m = {k: r[k] for k in _MEMORY_CONTEXT_FIELDS}
+                    if bucket == "system":
+                        system_mem.append(m)
+                    elif bucket == "own":
+                        own.append(m)
+                    elif bucket == "shared":
+                        m["agent"] = r["agent"]
+                        shared.append(m)
+
+            context = system_mem + own
+            # Shared lessons, tagged with their source; system ones are already in system_mem
             for item in shared:
-                item["shared_from"] = item.pop("agent", "")
-            context = system_mem + own + shared
+                source = item.pop("agent", "")
+                if source != "system":
+                    item["shared_from"] = source
+                    context.append(item)
             if prefs:
                 context.append({
                     "id": 0,
@@ -526,22 +1351,67 @@ class StateManager:
                     "tags": ["profile"],
                 })
             return context
-        except Exception as e:
-            print(f"[Supabase] get_memory_context error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_memory_context error")
             return []
 
+    async def warmup(self) -> None:
+        """(Re)load the system memories and user profile shared by every agent's context."""
+        system_mem, prefs = await asyncio.gather(
+            # System memories (ecosystem map, global anti-patterns) — always first
+            self.db.select("agent_memory", {
+                "select": "id,memory_type,content,importance,tags",
+                "agent": "eq.system",
+                "order": "importance.desc",
+                "limit": "5",
+            }),
+            self.db.select("user_profile", {
+                "select": "category,key,value",
+                "order": "category.asc",
+            }),
+        )
+        self._warm_system, self._warm_prefs = system_mem, prefs
+        self._warm_until = time.monotonic() + WARM_CACHE_TTL
+
+    async def _memory_context_selects(self, agent: str, limit: int) -> tuple[list, list, list, list]:
+        """The get_memory_context queries, for databases without the RPC.
+
+        System memories and prefs come from the warm cache; only the agent's
+        own and shared lessons are fetched live (alongside a refresh if due).
+        """
+        live = [
+            self.db.select("agent_memory", {
+                "select": "id,memory_type,content,importance,tags",
+                "agent": f"eq.{agent}",
+                "order": "importance.desc,created_at.desc",
+                "limit": str(min(limit, 15)),
+            }),
+            self.db.select("agent_memory", {
+                "select": "id,memory_type,content,importance,tags,agent",
+                "agent": f"neq.{agent}",
+                "importance": "gte.8",
+                "order": "importance.desc,created_at.desc",
+                "limit": "5",
+            }),
+        ]
+        if self._warm_until < time.monotonic():
+            live.append(self.warmup())
+        own, shared, *_ = await asyncio.gather(*live)
+        return list(self._warm_system), own, shared, self._warm_prefs
+
     async def delete_memory(self, memory_id: int) -> bool:
         if not self.db:
             return False
         try:
             await self.db.delete("agent_memory", {"id": memory_id})
             return True
-        except Exception as e:
-            print(f"[Supabase] delete_memory error: {e}")
+        except Exception:
+            logger.exception("[Supabase] delete_memory error")
             return False
 
     # ── User Profile ──────────────────────────────────────────────────────────
 
+    @_cached("user_profile")
     async def get_profile(self) -> list:
         if not self.db:
             return []
@@ -550,8 +1420,8 @@ class StateManager:
                 "select": "id,category,key,value,confidence,source,created_at",
                 "order": "category.asc,key.asc",
             })
-        except Exception as e:
-            print(f"[Supabase] get_profile error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_profile error")
             return []
 
     async def update_profile(self, category: str, key: str, value: str,
@@ -567,8 +1437,8 @@ class StateManager:
                 "confidence": 1.0 if source == "explicit" else 0.5,
             })
             return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] update_profile error: {e}")
+        except Exception:
+            logger.exception("[Supabase] update_profile error")
             return None
 
     # ── Task Feedback ─────────────────────────────────────────────────────────
@@ -578,15 +1448,14 @@ class StateManager:
         if not self.db:
             return None
         try:
-            rows = await self.db.insert_returning("task_feedback", {
+            return await self.db.queue_insert("task_feedback", {
                 "task_id": task_id,
                 "agent": agent,
                 "rating": rating,
                 "comment": comment,
             })
-            return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] save_feedback error: {e}")
+        except Exception:
+            logger.exception("[Supabase] save_feedback error")
             return None
 
     # ── Agent Errors ──────────────────────────────────────────────────────────
@@ -603,12 +1472,12 @@ class StateManager:
             }
             if task_id:
                 data["task_id"] = task_id
-            rows = await self.db.insert_returning("agent_errors", data)
-            return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] save_error error: {e}")
+            return await self.db.queue_insert("agent_errors", data)
+        except Exception:
+            logger.exception("[Supabase] save_error error")
             return None
 
+    @_cached("agent_errors")
     async def get_errors(self, agent: Optional[str] = None, limit: int = 50) -> list:
         if not self.db:
             return []
@@ -621,8 +1490,8 @@ class StateManager:
             if agent:
                 params["agent"] = f"eq.{agent}"
             return await self.db.select("agent_errors", params)
-        except Exception as e:
-            print(f"[Supabase] get_errors error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_errors error")
             return []
 
     async def update_error_reflection(self, error_id: int, reflection: str, lesson: str) -> bool:
@@ -634,8 +1503,8 @@ class StateManager:
                 "lesson": lesson,
             })
             return True
-        except Exception as e:
-            print(f"[Supabase] update_error_reflection error: {e}")
+        except Exception:
+            logger.exception("[Supabase] update_error_reflection error")
             return False
 
     async def get_agent_stats(self) -> list:
@@ -643,44 +1512,78 @@ class StateManager:
         if not self.db:
             return []
         try:
-            feedback, memories, errors, messages = await asyncio.gather(
-                self.db.select("task_feedback", {
-                    "select": "agent,rating",
-                }),
-                self.db.select("agent_memory", {
-                    "select": "agent,id",
-                }),
-                self.db.select("agent_errors", {
-                    "select": "agent,id",
-                }),
-                self.db.select("messages", {
-                    "select": "role,id",
-                }),
-            )
+            # Aggregated server-side by migrations/003_agent_stats_view.sql
+            try:
+                rows = await self.db.select("agent_stats_v", {
+                    "select": "agent,tasks_count,avg_rating,ratings_count,memory_count,error_count",
+                    "agent": _AGENT_IN,
+                }, strict=True)
+                by_agent = {r["agent"]: r for r in rows}
+            except SupabaseError as e:
+                # Only a missing view falls back; other errors are not worth a table scan
+                if e.status != 404 and e.code not in _MISSING_RELATION:
+                    raise
+                by_agent = await self._agent_stats_rows()
             stats = []
-            for key, defn in AGENT_DEFS.items():
-                agent_fb = [f for f in feedback if isinstance(f, dict) and f.get("agent") == key]
-                agent_mem = [m for m in memories if isinstance(m, dict) and m.get("agent") == key]
-                agent_err = [e for e in errors if isinstance(e, dict) and e.get("agent") == key]
-                agent_tasks = [m for m in messages if isinstance(m, dict) and m.get("role") == key]
-                ratings = [f["rating"] for f in agent_fb if f.get("rating")]
+            for key, defn in _AGENT_ITEMS:
+                r = by_agent.get(key) or {}
+                avg = r.get("avg_rating")
                 stats.append({
                     "agent": key,
                     "name": defn["name"],
                     "emoji": defn["emoji"],
                     "color": defn["color"],
                     "role": defn["role"],
-                    "tasks_count": len(agent_tasks),
-                    "avg_rating": round(sum(ratings) / len(ratings), 1) if ratings else None,
-                    "ratings_count": len(ratings),
-                    "memory_count": len(agent_mem),
-                    "error_count": len(agent_err),
+                    "tasks_count": r.get("tasks_count", 0),
+                    "avg_rating": round(float(avg), 1) if avg is not None else None,
+                    "ratings_count": r.get("ratings_count", 0),
+                    "memory_count": r.get("memory_count", 0),
+                    "error_count": r.get("error_count", 0),
                 })
             return stats
-        except Exception as e:
-            print(f"[Supabase] get_agent_stats error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_agent_stats error")
             return []
 
+    @_cached(ttl=AGGREGATE_CACHE_TTL)
+    async def _agent_stats_rows(self) -> dict[str, dict]:
+        """agent_stats_v computed client-side, for databases without the view.
+
+        Tables are read in pages (select_stream) and folded into the counters
+        as they arrive, so memory stays bounded however large they grow. The
+        scans are strict (a failed page raises) and the result is cached like
+        the other aggregates.
+        """
+        by_agent = {
+            key: {"tasks_count": 0, "ratings_count": 0, "memory_count": 0, "error_count": 0}
+            for key in AGENT_DEFS
+        }
+        rating_sums = dict.fromkeys(AGENT_DEFS, 0)
+
+        async def tally(table: str, params: dict, column: str, counter: str) -> None:
+            async for rows in self.db.select_stream(table, params, strict=True):
+                for row in rows:
+                    if (r := by_agent.get(row.get(column))) is not None:
+                        r[counter] += 1
+
+        async def tally_ratings() -> None:
+            params = {"select": "agent,rating", "agent": _AGENT_IN, "rating": "not.is.null"}
+            async for rows in self.db.select_stream("task_feedback", params, strict=True):
+                for f in rows:
+                    if f.get("rating") and (r := by_agent.get(f.get("agent"))) is not None:
+                        r["ratings_count"] += 1
+                        rating_sums[f["agent"]] += f["rating"]
+
+        await asyncio.gather(
+            tally("messages", {"select": "id,role", "role": _AGENT_IN}, "role", "tasks_count"),
+            tally("agent_memory", {"select": "id,agent", "agent": _AGENT_IN}, "agent", "memory_count"),
+            tally("agent_errors", {"select": "id,agent", "agent": _AGENT_IN}, "agent", "error_count"),
+            tally_ratings(),
+        )
+        for key, r in by_agent.items():
+            r["avg_rating"] = rating_sums[key] / r["ratings_count"] if r["ratings_count"] else None
+        return by_agent
+
     async def get_feedback(self, agent: Optional[str] = None, limit: int = 50) -> list:
         if not self.db:
             return []
@@ -693,8 +1596,8 @@ class StateManager:
             if agent:
                 params["agent"] = f"eq.{agent}"
             return await self.db.select("task_feedback", params)
-        except Exception as e:
-            print(f"[Supabase] get_feedback error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_feedback error")
             return []
 
     # ── Direct Chat ──────────────────────────────────────────────────────────
@@ -711,98 +1614,105 @@ class StateManager:
                 "emoji": agent_def.get("emoji", "🤖") if role == "direct_agent" else "👤",
                 "color": agent_def.get("color", "#64748b") if role == "direct_agent" else "#6366f1",
                 "content": content,
-                "msg_time": datetime.now().strftime("%H:%M"),
+                "msg_time": _now_hm(),
             })
-        except Exception as e:
-            print(f"[Supabase] save_direct_message error: {e}")
+        except Exception:
+            logger.exception("[Supabase] save_direct_message error")
 
     async def get_direct_messages(self, agent: str, limit: int = 30) -> list:
         """Get direct chat history for an agent."""
         if not self.db:
             return []
         try:
-            user_msgs, agent_msgs = await asyncio.gather(
-                self.db.select("messages", {
-                    "select": "role,content,created_at",
-                    "name": f"eq.{agent}",
-                    "role": "eq.direct_user",
-                    "order": "created_at.desc",
-                    "limit": str(limit),
-                }),
-                self.db.select("messages", {
-                    "select": "role,content,created_at",
-                    "name": f"eq.{agent}",
-                    "role": "eq.direct_agent",
-                    "order": "created_at.desc",
-                    "limit": str(limit),
-                }),
-            )
-            all_msgs = [m for m in (user_msgs + agent_msgs) if isinstance(m, dict)]
-            all_msgs.sort(key=lambda x: x.get("created_at", ""))
-            all_msgs = all_msgs[-limit:]
+            # Both sides of the conversation in one query, newest first
+            rows = await self.db.select("messages", {
+                "select": "role,content,created_at",
+                "name": f"eq.{agent}",
+                "role": "in.(direct_user,direct_agent)",
+                "order": "created_at.desc",
+                "limit": str(limit),
+            })
             return [
                 {
                     "role": "user" if r["role"] == "direct_user" else "assistant",
                     "content": r["content"],
                     "created_at": r.get("created_at", ""),
                 }
-                for r in all_msgs
+                for r in reversed(rows)
             ]
-        except Exception as e:
-            print(f"[Supabase] get_direct_messages error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_direct_messages error")
             return []
 
     # ── Analytics ────────────────────────────────────────────────────────────
 
+    # Not tied to tables: tasks/diary are written on every agent event, and a
+    # day-scale aggregate that is up to a minute old is fine for the dashboard
+    @_cached(ttl=AGGREGATE_CACHE_TTL)
     async def get_analytics_overview(self, days: int = 7) -> dict:
         """Aggregate stats for the analytics dashboard."""
         if not self.db:
             return {}
         try:
-            from datetime import timedelta
-            since = (datetime.utcnow() - timedelta(days=days)).isoformat()
+            since = _utc_since(days * 86400)
 
-            tasks, feedback, errors, memories = await asyncio.gather(
+            # Aggregated in Postgres by migrations/004_analytics_overview_rpc.sql
+            rows = await self.db.rpc("analytics_overview", {"since": since})
+            if rows:
+                r = rows[0]
+                avg = r.get("avg_rating")
+                return {
+                    "period_days": days,
+                    "total_tasks": r.get("total_tasks", 0),
+                    "done_tasks": r.get("done_tasks", 0),
+                    "avg_rating": round(float(avg), 1) if avg is not None else None,
+                    "ratings_count": r.get("ratings_count", 0),
+                    "total_errors": r.get("total_errors", 0),
+                    "total_memories": r.get("total_memories", 0),
+                    "tasks_by_day": _day_series(since, r.get("tasks_by_day") or {}),
+                }
+
+            # A failed query leaves only its own fields null
+            (tasks, feedback, total_errors, total_memories), failed = _settled(await asyncio.gather(
                 self.db.select("tasks", {
-                    "select": "id,status,created_at,finished_at",
+                    "select": "status,created_at",
                     "created_at": f"gte.{since}",
-                }),
+                }, strict=True),
                 self.db.select("task_feedback", {
-                    "select": "rating,created_at",
-                    "created_at": f"gte.{since}",
-                }),
-                self.db.select("agent_errors", {
-                    "select": "id,created_at",
-                    "created_at": f"gte.{since}",
-                }),
-                self.db.select("agent_memory", {
-                    "select": "id,created_at",
+                    "select": "rating",
                     "created_at": f"gte.{since}",
-                }),
-            )
-
-            done_tasks = [t for t in tasks if isinstance(t, dict) and t.get("status") == "done"]
-            ratings = [f["rating"] for f in feedback if isinstance(f, dict) and f.get("rating")]
-
-            tasks_by_day: dict[str, int] = {}
-            for t in tasks:
-                if isinstance(t, dict) and t.get("created_at"):
-                    day = t["created_at"][:10]
-                    tasks_by_day[day] = tasks_by_day.get(day, 0) + 1
-
-            return {
+                }, strict=True),
+                self.db.count("agent_errors", {"created_at": f"gte.{since}"}),
+                self.db.count("agent_memory", {"created_at": f"gte.{since}"}),
+                return_exceptions=True,
+            ), "get_analytics_overview")
+
+            total_tasks = done_count = None
+            tasks_by_day: Counter = Counter()
+            if tasks is not None:
+                total_tasks = len(tasks)
+                done_count = sum(1 for t in tasks if t.get("status") == "done")
+                tasks_by_day = Counter(c[:10] for t in tasks if (c := t.get("created_at")))
+            ratings = None
+            if feedback is not None:
+                # Rows come from _rows, so each is a dict carrying the selected column
+                ratings = list(filter(None, map(itemgetter("rating"), feedback)))
+
+            overview = {
                 "period_days": days,
-                "total_tasks": len(tasks),
-                "done_tasks": len(done_tasks),
+                "total_tasks": total_tasks,
+                "done_tasks": done_count,
                 "avg_rating": round(sum(ratings) / len(ratings), 1) if ratings else None,
-                "ratings_count": len(ratings),
-                "total_errors": len(errors),
-                "total_memories": len(memories),
-                "tasks_by_day": dict(sorted(tasks_by_day.items())),
+                "ratings_count": len(ratings) if ratings is not None else None,
+                "total_errors": total_errors,
+                "total_memories": total_memories,
+                "tasks_by_day": _day_series(since, tasks_by_day),
             }
-        except Exception as e:
-            print(f"[Supabase] get_analytics_overview error: {e}")
-            return {}
+            # Partial results are returned but not cached, so the next poll retries
+            return _Uncached(overview) if failed else overview
+        except Exception:
+            logger.exception("[Supabase] get_analytics_overview error")
+            return _Uncached({})
 
     # ── Delete Profile Entry ─────────────────────────────────────────────────
 
@@ -810,41 +1720,45 @@ class StateManager:
         if not self.db:
             return False
         try:
-            await self.db.delete("user_profile", {"id": profile_id})
+            await self.db.queue_delete("user_profile", profile_id)
             return True
-        except Exception as e:
-            print(f"[Supabase] delete_profile error: {e}")
+        except Exception:
+            logger.exception("[Supabase] delete_profile error")
             return False
 
     # ── Diary ─────────────────────────────────────────────────────────────────
 
     async def add_diary_entry(self, agent: str, event_type: str, content: str) -> None:
+        """Queue a diary row for the bounded bulk writer (see _message_writer)."""
         if not self.db:
             return
-        try:
-            await self.db.insert("diary", {
-                "agent": agent,
-                "event_type": event_type,
-                "content": content,
-                "created_at": datetime.utcnow().isoformat(),
-            })
-        except Exception as e:
-            print(f"[Supabase] add_diary_entry error: {e}")
+        self._queue_row("diary", {
+            "agent": agent,
+            "event_type": event_type,
+            "content": content,
+            "created_at": _utc_iso(),
+        })
 
-    async def get_diary(self, agent: Optional[str] = None, limit: int = 50) -> list:
+    @_cached("diary")
+    async def get_diary(
+        self, agent: Optional[str] = None, limit: int = 50, before: Optional[str] = None,
+        before_id: Optional[int] = None,
+    ) -> list:
+        """Newest entries first; (`before`, `before_id`) fetches the page after that row."""
         if not self.db:
             return []
         try:
             params: dict = {
                 "select": "id,agent,event_type,content,created_at",
-                "order": "created_at.desc",
+                "order": "created_at.desc,id.desc",
                 "limit": str(limit),
             }
             if agent:
                 params["agent"] = f"eq.{agent}"
+            _page_before(params, before, before_id)
             return await self.db.select("diary", params)
-        except Exception as e:
-            print(f"[Supabase] get_diary error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_diary error")
             return []
 
     # ── Scheduled Tasks ──────────────────────────────────────────────────────
@@ -858,68 +1772,73 @@ class StateManager:
                 "horizon": horizon,
                 "priority": priority,
                 "status": "pending",
-                "created_at": datetime.utcnow().isoformat(),
+                "created_at": _utc_iso(),
             })
             return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] create_scheduled_task error: {e}")
+        except Exception:
+            logger.exception("[Supabase] create_scheduled_task error")
             return None
 
+    @_cached("scheduled_tasks")
     async def get_scheduled_tasks(
         self, horizon: Optional[str] = None, status: Optional[str] = None, limit: int = 50,
+        before: Optional[str] = None, before_id: Optional[int] = None, summary: bool = False,
     ) -> list:
+        """
+        Newest first; (`before`, `before_id`) fetches the page after that row.
+        `summary` skips the result/action_items columns.
+        """
         if not self.db:
             return []
         try:
             params: dict = {
-                "select": "id,title,horizon,priority,status,result,action_items,review_status,assigned_agent,linked_task_id,created_at,updated_at",
-                "order": "created_at.desc",
+                "select": _SCHEDULED_TASK_SUMMARY_COLS if summary else _SCHEDULED_TASK_COLS,
+                "order": "created_at.desc,id.desc",
                 "limit": str(limit),
             }
             if horizon:
                 params["horizon"] = f"eq.{horizon}"
             if status:
                 params["status"] = f"eq.{status}"
+            _page_before(params, before, before_id)
             return await self.db.select("scheduled_tasks", params)
-        except Exception as e:
-            print(f"[Supabase] get_scheduled_tasks error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_scheduled_tasks error")
             return []
 
     async def update_scheduled_task_status(self, task_id: int, new_status: str) -> bool:
         if not self.db:
             return False
         try:
-            await self.db.update("scheduled_tasks", {"id": task_id}, {
+            await self.db.queue_update("scheduled_tasks", task_id, {
                 "status": new_status,
-                "updated_at": datetime.utcnow().isoformat(),
+                "updated_at": _utc_iso(),
             })
             return True
-        except Exception as e:
-            print(f"[Supabase] update_scheduled_task_status error: {e}")
+        except Exception:
+            logger.exception("[Supabase] update_scheduled_task_status error")
             return False
 
     async def get_scheduled_task_by_id(self, task_id: int) -> Optional[dict]:
         if not self.db:
             return None
         try:
-            rows = await self.db.select("scheduled_tasks", {
-                "select": "id,title,horizon,priority,status,result,action_items,review_status,assigned_agent,linked_task_id,created_at,updated_at",
-                "id": f"eq.{task_id}",
-            })
-            return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] get_scheduled_task_by_id error: {e}")
+            return await self.db.select_by_id(
+                "scheduled_tasks", task_id, _SCHEDULED_TASK_COLS,
+            )
+        except Exception:
+            logger.exception("[Supabase] get_scheduled_task_by_id error")
             return None
 
     async def update_scheduled_task(self, task_id: int, data: dict) -> bool:
         if not self.db:
             return False
         try:
-            data["updated_at"] = datetime.utcnow().isoformat()
+            data["updated_at"] = _utc_iso()
             await self.db.update("scheduled_tasks", {"id": task_id}, data)
             return True
-        except Exception as e:
-            print(f"[Supabase] update_scheduled_task error: {e}")
+        except Exception:
+            logger.exception("[Supabase] update_scheduled_task error")
             return False
 
     # ── Quests ────────────────────────────────────────────────────────────────
@@ -939,27 +1858,33 @@ class StateManager:
                 "status": "pending",
                 "xp_reward": xp_reward,
                 "data": data or {},
-                "created_at": datetime.utcnow().isoformat(),
+                "created_at": _utc_iso(),
             })
             return rows[0] if rows else None
-        except Exception as e:
-            print(f"[Supabase] create_quest error: {e}")
+        except Exception:
+            logger.exception("[Supabase] create_quest error")
             return None
 
-    async def get_quests(self, status: Optional[str] = None, limit: int = 50) -> list:
+    @_cached("quests")
+    async def get_quests(
+        self, status: Optional[str] = None, limit: int = 50, before: Optional[str] = None,
+        before_id: Optional[int] = None,
+    ) -> list:
+        """Newest first; (`before`, `before_id`) fetches the page after that row."""
         if not self.db:
             return []
         try:
             params: dict = {
-                "select": "id,title,description,quest_type,agent,status,data,response,xp_reward,created_at,completed_at",
-                "order": "created_at.desc",
+                "select": _QUEST_COLS,
+                "order": "created_at.desc,id.desc",
                 "limit": str(limit),
             }
             if status:
                 params["status"] = f"eq.{status}"
+            _page_before(params, before, before_id)
             return await self.db.select("quests", params)
-        except Exception as e:
-            print(f"[Supabase] get_quests error: {e}")
+        except Exception:
+            logger.exception("[Supabase] get_quests error")
             return []
 
     async def complete_quest(self, quest_id: int, response: Optional[dict] = None) -> bool:
@@ -968,73 +1893,89 @@ class StateManager:
         try:
             update_data: dict = {
                 "status": "completed",
-                "completed_at": datetime.utcnow().isoformat(),
+                "completed_at": _utc_iso(),
             }
             if response is not None:
                 update_data["response"] = response
-            await self.db.update("quests", {"id": quest_id}, update_data)
+            await self.db.queue_update("quests", quest_id, update_data)
             return True
-        except Exception as e:
-            print(f"[Supabase] complete_quest error: {e}")
+        except Exception:
+            logger.exception("[Supabase] complete_quest error")
             return False
 
+    @_cached(ttl=AGGREGATE_CACHE_TTL)
     async def get_briefing(self) -> dict:
         """24h summary: pending quests, completed tasks, diary entries, active agents."""
         if not self.db:
             return {"quests_pending": 0, "tasks_completed_24h": 0, "diary_entries_24h": 0,
                     "active_agents_24h": [], "last_diary": []}
         try:
-            from datetime import timedelta
-            since = (datetime.utcnow() - timedelta(hours=24)).isoformat()
+            since = _utc_since(86400)
+
+            # One round-trip via migrations/005_briefing_rpc.sql (007: trimmed diary content)
+            rows = await self.db.rpc("briefing_24h", {"since": since})
+            if rows:
+                r = rows[0]
+                return {
+                    "quests_pending": r.get("quests_pending", 0),
+                    "tasks_completed_24h": r.get("tasks_completed_24h", 0),
+                    "diary_entries_24h": r.get("diary_entries_24h", 0),
+                    "active_agents_24h": r.get("active_agents_24h") or [],
+                    "last_diary": r.get("last_diary") or [],
+                }
 
-            quests_pending, tasks_24h, diary_24h, last_diary = await asyncio.gather(
-                self.db.select("quests", {
-                    "select": "id",
+            # Fallback while the function is not deployed. Counters come back
+            # as Content-Range totals; diary rows are still
+            # fetched because active_agents_24h needs their agent column
+            # A failed query leaves only its own fields null/empty
+            (quests_pending, tasks_24h, diary_24h, last_diary), failed = _settled(await asyncio.gather(
+                self.db.count("quests", {
                     "status": "eq.pending",
                 }),
-                self.db.select("tasks", {
-                    "select": "id",
+                self.db.count("tasks", {
                     "status": "eq.done",
                     "finished_at": f"gte.{since}",
                 }),
                 self.db.select("diary", {
-                    "select": "id,agent",
+                    "select": "agent",
                     "created_at": f"gte.{since}",
-                }),
+                }, strict=True),
                 self.db.select("diary", {
                     "select": "id,agent,event_type,content,created_at",
                     "order": "created_at.desc",
                     "limit": "5",
-                }),
-            )
-
-            active_agents = list({r["agent"] for r in diary_24h if isinstance(r, dict)})
-
-            return {
-                "quests_pending": len(quests_pending) if isinstance(quests_pending, list) else 0,
-                "tasks_completed_24h": len(tasks_24h) if isinstance(tasks_24h, list) else 0,
-                "diary_entries_24h": len(diary_24h) if isinstance(diary_24h, list) else 0,
+                }, strict=True),
+                return_exceptions=True,
+            ), "get_briefing")
+
+            # Distinct agents in order of first appearance
+            active_agents = list(dict.fromkeys(a for r in diary_24h or () if (a := r.get("agent"))))
+            for r in last_diary or ():
+                if isinstance(c := r.get("content"), str):
+                    r["content"] = c[:BRIEFING_PREVIEW_CHARS]
+
+            briefing = {
+                "quests_pending": quests_pending,
+                "tasks_completed_24h": tasks_24h,
+                "diary_entries_24h": len(diary_24h) if diary_24h is not None else None,
                 "active_agents_24h": active_agents,
-                "last_diary": last_diary if isinstance(last_diary, list) else [],
+                "last_diary": last_diary or [],
             }
-        except Exception as e:
-            print(f"[Supabase] get_briefing error: {e}")
-            return {"quests_pending": 0, "tasks_completed_24h": 0, "diary_entries_24h": 0,
-                    "active_agents_24h": [], "last_diary": []}
+            # Partial results are returned but not cached, so the next poll retries
+            return _Uncached(briefing) if failed else briefing
+        except Exception:
+            logger.exception("[Supabase] get_briefing error")
+            return _Uncached({"quests_pending": 0, "tasks_completed_24h": 0, "diary_entries_24h": 0,
+                              "active_agents_24h": [], "last_diary": []})
 
     # ── Public API ────────────────────────────────────────────────────────────
 
     def add_user_message(self, content: str) -> dict:
         msg = {
-            "role":    "user",
-            "name":    "Вы",
-            "emoji":   "👤",
-            "color":   "#6366f1",
+            **_USER_TPL,
             "content": content,
-            "time":    datetime.now().strftime("%H:%M"),
+            "time":    _now_hm(),
         }
-        self.history.append(msg)
-        if len(self.history) > 200:
-            self.history.pop(0)
+        self.history.append(orjson.dumps(msg))
         self._save_message(msg)
         return msg
@@ -1,23 +1,34 @@
 import asyncio
+import atexit
 import json
 import logging
 import os
+import queue
+import re
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
-logging.basicConfig(level=logging.INFO)
+# Records are handed to a listener thread, so a log call never blocks the
+# event loop on a stdout write
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(_log_queue)])
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger("agent-office")
 
 from dotenv import load_dotenv
 load_dotenv(Path(__file__).parent / ".env")
 
 import httpx
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.requests import Request
 from fastapi.responses import JSONResponse, Response
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from agents import StateManager, AGENT_DEFS
 import tg_bot
 from monitor import SystemMonitor
@@ -144,7 +155,11 @@ _monitor = None
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global _tg_app, _monitor
-    await state.load_history()
+    # Fire-and-forget coroutines that finish without suspending (e.g. no DB
+    # configured) then skip Task scheduling entirely. Python 3.12+ only.
+    eager_factory = getattr(asyncio, "eager_task_factory", None)
+    if eager_factory is not None:
+        asyncio.get_running_loop().set_task_factory(eager_factory)
 
     _tg_app = tg_bot.create_app()
     if _tg_app:
@@ -168,10 +183,11 @@ async def lifespan(app: FastAPI):
         await _tg_app.updater.stop()
         await _tg_app.stop()
         await _tg_app.shutdown()
+    await state.aclose()
 
 
 APP_VERSION = "4.0.0-ai-office"
-_startup_time = datetime.utcnow()
+_startup_time = datetime.now(timezone.utc)
 
 app = FastAPI(lifespan=lifespan, version=APP_VERSION)
 
@@ -198,29 +214,68 @@ async def root():
 
 # ── Broadcast to all WS clients ───────────────────────────────────────────────
 
-async def broadcast(event: dict):
-    dead = set()
-    for ws in list(clients):
-        try:
-            await ws.send_json(event)
-        except Exception:
-            dead.add(ws)
-    clients.difference_update(dead)
+WS_SEND_TIMEOUT = 5.0  # seconds; a client slower than this is dropped
+
+
+# Close handshakes of dropped clients, referenced until they finish
+_closing: set[asyncio.Task] = set()
+
+
+async def _close_dropped(ws: WebSocket) -> None:
+    """Close a dropped client's socket so its browser notices and reconnects.
+    A send cut off by the timeout may have left a partial frame, so the
+    connection is not reusable anyway."""
+    try:
+        await asyncio.wait_for(ws.close(code=1011), WS_SEND_TIMEOUT)
+    except Exception:
+        pass
+
+
+async def _send_or_drop(ws: WebSocket, text: str) -> WebSocket | None:
+    """Send to one client; return it if it failed or timed out."""
+    try:
+        await asyncio.wait_for(ws.send_text(text), WS_SEND_TIMEOUT)
+        return None
+    except Exception:
+        return ws
+
+
+async def broadcast(event: dict | bytes):
+    """Send an event to every WS client. Accepts a dict or pre-encoded JSON bytes;
+    either way the payload is serialized once and shared by all clients.
+    Sends run concurrently, so one slow client cannot hold up the rest."""
+    if not clients:
+        return
+    text = (event if isinstance(event, bytes) else orjson.dumps(event)).decode()
+    results = await asyncio.gather(*(_send_or_drop(ws, text) for ws in list(clients)))
+    for ws in results:
+        if ws is not None and ws in clients:
+            clients.discard(ws)
+            task = asyncio.create_task(_close_dropped(ws))
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
 
 
 
 # ── WebSocket — browser ↔ dashboard ──────────────────────────────────────────
 
+def _init_frame() -> bytes:
+    """Full agents + recent history snapshot as JSON bytes.
+    History entries are already encoded, so they are spliced in verbatim."""
+    return b"".join((
+        b'{"type":"init","agents":', orjson.dumps(state.agent_states()),
+        b',"history":', state.recent_history_json(80),
+        b"}",
+    ))
+
+
 @app.websocket("/ws")
 async def ws_handler(websocket: WebSocket):
     await websocket.accept()
+    await state.ensure_history()
     clients.add(websocket)
 
-    await websocket.send_json({
-        "type":    "init",
-        "agents":  state.agent_states(),
-        "history": state.history[-80:],
-    })
+    await websocket.send_text(_init_frame().decode())
 
     try:
         while True:
@@ -286,9 +341,7 @@ async def n8n_callback(request: Request):
 
     # Log to diary
     if agent and message:
-        asyncio.create_task(
-            state.add_diary_entry(agent, "status_change", message)
-        )
+        await state.add_diary_entry(agent, "status_change", message)
 
     # Save lessons from worker responses
     lessons = payload.get("lessons_learned")
@@ -345,7 +398,7 @@ async def n8n_callback(request: Request):
             _task_results.append({
                 "agent": agent,
                 "result": message,
-                "timestamp": __import__("datetime").datetime.utcnow().isoformat(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
             })
 
     # When manager starts thinking — reset accumulator
@@ -383,7 +436,7 @@ async def n8n_callback(request: Request):
                     await state.db.update("tasks", {"id": int(save_task_id)}, {
                         "summary": combined,
                         "status": "done",
-                        "finished_at": datetime.utcnow().isoformat(),
+                        "finished_at": datetime.now(timezone.utc).isoformat(),
                     })
                     logger.info(f"[idle] Saved full result to tasks #{save_task_id}")
                 except Exception as e:
@@ -420,8 +473,10 @@ async def api_agent_task_detail(task_id: int):
 # ── REST: diary ───────────────────────────────────────────────────────────────
 
 @app.get("/api/diary")
-async def api_diary(agent: str = "", limit: int = 50):
-    entries = await state.get_diary(agent=agent or None, limit=min(limit, 200))
+async def api_diary(agent: str = "", limit: int = 50, before: str = "", before_id: int | None = None):
+    entries = await state.get_diary(
+        agent=agent or None, limit=min(limit, 200), before=before or None, before_id=before_id,
+    )
     return JSONResponse({"diary": entries})
 
 
@@ -457,11 +512,17 @@ async def api_create_scheduled_task(request: Request):
 
 
 @app.get("/api/scheduled-tasks")
-async def api_list_scheduled_tasks(horizon: str = "", status: str = "", limit: int = 50):
+async def api_list_scheduled_tasks(
+    horizon: str = "", status: str = "", limit: int = 50, before: str = "", before_id: int | None = None,
+    summary: bool = False,
+):
     tasks = await state.get_scheduled_tasks(
         horizon=horizon or None,
         status=status or None,
         limit=min(limit, 200),
+        before=before or None,
+        before_id=before_id,
+        summary=summary,
     )
     return JSONResponse({"tasks": tasks})
 
@@ -650,10 +711,12 @@ async def api_create_quest(request: Request):
 
 
 @app.get("/api/quests")
-async def api_list_quests(status: str = "", limit: int = 50):
+async def api_list_quests(status: str = "", limit: int = 50, before: str = "", before_id: int | None = None):
     quests = await state.get_quests(
         status=status or None,
         limit=min(limit, 200),
+        before=before or None,
+        before_id=before_id,
     )
     return JSONResponse({"quests": quests})
 
@@ -843,7 +906,6 @@ async def api_articles_post(request: Request):
 
 
 def _md_to_html(text: str) -> str:
-    import re
     text = re.sub(r'^### (.+)$', r'<h3>\1</h3>', text, flags=re.MULTILINE)
     text = re.sub(r'^## (.+)$',  r'<h2>\1</h2>', text, flags=re.MULTILINE)
     text = re.sub(r'^# (.+)$',   r'<h1>\1</h1>', text, flags=re.MULTILINE)
@@ -1365,8 +1427,8 @@ async def _auto_reflect_error(error_id: int):
             await client.post(
                 f"http://localhost:{os.getenv('PORT', '8080')}/api/errors/{error_id}/reflect"
             )
-    except Exception as e:
-        print(f"[auto_reflect] error: {e}")
+    except Exception:
+        logger.exception("[auto_reflect] error")
 
 
 # ── Helper: link completed task result to scheduled_task ─────────────────────
@@ -1423,8 +1485,8 @@ async def _link_result_to_scheduled_task(result: str):
             "assigned_agent": scheduled.get("assigned_agent", "manager"),
         })
         await broadcast({"type": "tasks_update"})
-    except Exception as e:
-        print(f"[link_result] error: {e}")
+    except Exception:
+        logger.exception("[link_result] error")
 
 
 def _is_clarification_needed(response: str | None) -> bool:
@@ -1555,12 +1617,12 @@ async def _check_phase2_trigger(quest_id: int, response: str | None):
                     N8N_MANAGER_WEBHOOK,
                     json={"task": phase2_task},
                 )
-                print(f"[phase2] Triggered n8n: {resp.status_code}")
+                logger.info("[phase2] Triggered n8n: %s", resp.status_code)
         else:
-            print("[phase2] No N8N_MANAGER_WEBHOOK configured")
+            logger.warning("[phase2] No N8N_MANAGER_WEBHOOK configured")
 
-    except Exception as e:
-        print(f"[phase2] error: {e}")
+    except Exception:
+        logger.exception("[phase2] error")
 
 
 async def _notify_user_task_done(result: str):
@@ -1667,8 +1729,8 @@ async def _link_result_to_idea(task_title: str, result: str):
                     "status": "done",
                 })
                 return
-    except Exception as e:
-        print(f"[link_idea] error: {e}")
+    except Exception:
+        logger.exception("[link_idea] error")
 
 
 # ── Background: stuck task timeout checker ────────────────────────────────────
@@ -1680,7 +1742,7 @@ async def _task_timeout_checker():
         if not state.db:
             continue
         try:
-            cutoff = (datetime.utcnow() - timedelta(minutes=10)).isoformat()
+            cutoff = (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
             stuck = await state.db.select("tasks", {
                 "status": "eq.processing",
                 "created_at": f"lt.{cutoff}",
@@ -1690,11 +1752,11 @@ async def _task_timeout_checker():
                     "status": "error",
                     "summary": "Timeout: задача не получила ответ от n8n в течение 10 минут",
                 })
-                print(f"[timeout] Task {task['id']} marked as error (stuck >10min)")
+                logger.warning("[timeout] Task %s marked as error (stuck >10min)", task["id"])
             if stuck:
                 await broadcast({"type": "tasks_update"})
-        except Exception as e:
-            print(f"[timeout_checker] error: {e}")
+        except Exception:
+            logger.exception("[timeout_checker] error")
 
 
 # ── Helper: forward task to n8n ───────────────────────────────────────────────
@@ -1728,7 +1790,7 @@ async def _call_n8n(task: str, task_id: int):
             if resp.status_code >= 400:
                 raise Exception(f"n8n returned {resp.status_code}: {resp.text[:200]}")
     except Exception as e:
-        print(f"[_call_n8n] ERROR for task {task_id}: {e}")
+        logger.error("[_call_n8n] ERROR for task %s: %s", task_id, e)
         if state.db:
             try:
                 await state.db.update("tasks", {"id": task_id}, {
@@ -1782,7 +1844,7 @@ async def api_admin_health():
     """System health overview."""
     return JSONResponse({
         "version": APP_VERSION,
-        "uptime_sec": (datetime.utcnow() - _startup_time).total_seconds(),
+        "uptime_sec": (datetime.now(timezone.utc) - _startup_time).total_seconds(),
         "ws_clients": len(clients),
         "tg_bot_active": _tg_app is not None,
         "n8n_webhook": N8N_MANAGER_WEBHOOK,
@@ -1791,6 +1853,14 @@ async def api_admin_health():
     })
 
 
+@app.get("/api/admin/pool")
+async def api_admin_pool():
+    """Supabase HTTP connection pool usage."""
+    if not state.db:
+        return JSONResponse({"db_connected": False})
+    return JSONResponse({"db_connected": True, **state.db.pool_stats()})
+
+
 @app.post("/api/admin/agents/reset")
 async def api_admin_reset_agents():
     """Reset all agents to idle status."""
@@ -1798,11 +1868,7 @@ async def api_admin_reset_agents():
         state.agents[key].status = "idle"
         state.agents[key].task = ""
         state.agents[key].progress = 0
-    await broadcast({
-        "type": "init",
-        "agents": state.agent_states(),
-        "history": state.history[-80:],
-    })
+    await broadcast(_init_frame())
     return JSONResponse({"ok": True})
 
 
@@ -1843,7 +1909,7 @@ async def api_admin_metrics():
     """System metrics for monitoring."""
     metrics = {
         "version": APP_VERSION,
-        "uptime_sec": (datetime.utcnow() - _startup_time).total_seconds(),
+        "uptime_sec": (datetime.now(timezone.utc) - _startup_time).total_seconds(),
         "ws_clients": len(clients),
         "agents_active": sum(
             1 for a in state.agents.values()
@@ -1851,7 +1917,7 @@ async def api_admin_metrics():
         ),
     }
     if state.db:
-        cutoff = (datetime.utcnow() - timedelta(hours=24)).isoformat()
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=24)).isoformat()
         errors = await state.db.select("agent_errors", {
             "created_at": f"gt.{cutoff}",
         })
@@ -0,0 +1,55 @@
+-- Контекст памяти агента одним запросом (StateManager.get_memory_context)
+-- Выполнить в Supabase SQL Editor: https://supabase.com/dashboard/project/njhbitemndotsfxxwzat/sql
+--
+-- bucket: 'system' | 'own' | 'shared' | 'prefs'; rn — порядок внутри bucket.
+-- Пока функция не создана, get_memory_context работает через четыре SELECT.
+
+CREATE OR REPLACE FUNCTION get_memory_context(p_agent TEXT, lim INT DEFAULT 20)
+RETURNS TABLE (
+    bucket      TEXT,
+    rn          BIGINT,
+    id          BIGINT,
+    memory_type TEXT,
+    content     TEXT,
+    importance  SMALLINT,
+    tags        TEXT[],
+    agent       TEXT,
+    category    TEXT,
+    key         TEXT,
+    value       TEXT
+)
+LANGUAGE sql STABLE AS $$
+    -- Системная память (карта экосистемы, глобальные анти-паттерны)
+    (SELECT 'system', ROW_NUMBER() OVER (ORDER BY m.importance DESC),
+            m.id, m.memory_type, m.content, m.importance, m.tags, m.agent,
+            NULL::TEXT, NULL::TEXT, NULL::TEXT
+       FROM agent_memory m
+      WHERE m.agent = 'system'
+      ORDER BY m.importance DESC
+      LIMIT 5)
+    UNION ALL
+    -- Собственные уроки агента
+    (SELECT 'own', ROW_NUMBER() OVER (ORDER BY m.importance DESC, m.created_at DESC),
+            m.id, m.memory_type, m.content, m.importance, m.tags, m.agent,
+            NULL, NULL, NULL
+       FROM agent_memory m
+      WHERE m.agent = p_agent
+      ORDER BY m.importance DESC, m.created_at DESC
+      LIMIT LEAST(lim, 15))
+    UNION ALL
+    -- Важные уроки других агентов
+    (SELECT 'shared', ROW_NUMBER() OVER (ORDER BY m.importance DESC, m.created_at DESC),
+            m.id, m.memory_type, m.content, m.importance, m.tags, m.agent,
+            NULL, NULL, NULL
+       FROM agent_memory m
+      WHERE m.agent <> p_agent AND m.importance >= 8
+      ORDER BY m.importance DESC, m.created_at DESC
+      LIMIT 5)
+    UNION ALL
+    -- Профиль пользователя
+    (SELECT 'prefs', ROW_NUMBER() OVER (ORDER BY p.category ASC),
+            NULL, NULL, NULL, NULL, NULL, NULL,
+            p.category, p.key, p.value
+       FROM user_profile p)
+    ORDER BY 1, 2;
+$$;
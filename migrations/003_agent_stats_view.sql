@@ -0,0 +1,37 @@
+-- Агрегаты по агентам для /api/agents/stats (StateManager.get_agent_stats)
+-- Выполнить в Supabase SQL Editor: https://supabase.com/dashboard/project/njhbitemndotsfxxwzat/sql
+--
+-- Одна строка на агента вместо выгрузки task_feedback / agent_memory /
+-- agent_errors / messages целиком. Пока view не создан, get_agent_stats
+-- считает по-старому в Python.
+
+CREATE OR REPLACE VIEW agent_stats_v AS
+WITH t AS (
+    SELECT role AS agent, COUNT(*) AS tasks_count
+      FROM messages
+     GROUP BY role
+), f AS (
+    SELECT agent,
+           ROUND(AVG(rating) FILTER (WHERE rating <> 0), 1) AS avg_rating,
+           COUNT(rating) FILTER (WHERE rating <> 0)         AS ratings_count
+      FROM task_feedback
+     GROUP BY agent
+), m AS (
+    SELECT agent, COUNT(*) AS memory_count
+      FROM agent_memory
+     GROUP BY agent
+), e AS (
+    SELECT agent, COUNT(*) AS error_count
+      FROM agent_errors
+     GROUP BY agent
+)
+SELECT agent,
+       COALESCE(t.tasks_count, 0)   AS tasks_count,
+       f.avg_rating,
+       COALESCE(f.ratings_count, 0) AS ratings_count,
+       COALESCE(m.memory_count, 0)  AS memory_count,
+       COALESCE(e.error_count, 0)   AS error_count
+  FROM t
+  FULL JOIN f USING (agent)
+  FULL JOIN m USING (agent)
+  FULL JOIN e USING (agent);
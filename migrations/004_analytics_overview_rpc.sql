@@ -0,0 +1,33 @@
+-- Сводка для аналитики одной строкой (StateManager.get_analytics_overview)
+-- Выполнить в Supabase SQL Editor: https://supabase.com/dashboard/project/njhbitemndotsfxxwzat/sql
+--
+-- Агрегаты считаются в Postgres, по сети идёт одна строка вместо всех
+-- задач/оценок/ошибок/воспоминаний за период. Пока функция не создана,
+-- get_analytics_overview считает по-старому в Python.
+
+CREATE OR REPLACE FUNCTION analytics_overview(since TIMESTAMPTZ)
+RETURNS TABLE (
+    total_tasks    BIGINT,
+    done_tasks     BIGINT,
+    avg_rating     NUMERIC,
+    ratings_count  BIGINT,
+    total_errors   BIGINT,
+    total_memories BIGINT,
+    tasks_by_day   JSONB
+)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        (SELECT COUNT(*) FROM tasks WHERE created_at >= since),
+        (SELECT COUNT(*) FROM tasks WHERE created_at >= since AND status = 'done'),
+        (SELECT ROUND(AVG(rating) FILTER (WHERE rating <> 0), 1)
+           FROM task_feedback WHERE created_at >= since),
+        (SELECT COUNT(rating) FILTER (WHERE rating <> 0)
+           FROM task_feedback WHERE created_at >= since),
+        (SELECT COUNT(*) FROM agent_errors WHERE created_at >= since),
+        (SELECT COUNT(*) FROM agent_memory WHERE created_at >= since),
+        (SELECT COALESCE(jsonb_object_agg(day, n), '{}'::jsonb)
+           FROM (SELECT to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD') AS day, COUNT(*) AS n
+                   FROM tasks
+                  WHERE created_at >= since
+                  GROUP BY 1) d);
+$$;
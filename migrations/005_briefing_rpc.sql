@@ -0,0 +1,27 @@
+-- Брифинг за 24 часа одной строкой (StateManager.get_briefing)
+-- Выполнить в Supabase SQL Editor: https://supabase.com/dashboard/project/njhbitemndotsfxxwzat/sql
+--
+-- Один запрос вместо четырёх. since передаёт приложение (округлено до 10 с).
+-- Пока функция не создана, get_briefing работает через отдельные запросы.
+
+CREATE OR REPLACE FUNCTION briefing_24h(since TIMESTAMPTZ)
+RETURNS TABLE (
+    quests_pending      BIGINT,
+    tasks_completed_24h BIGINT,
+    diary_entries_24h   BIGINT,
+    active_agents_24h   TEXT[],
+    last_diary          JSONB
+)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        (SELECT COUNT(*) FROM quests WHERE status = 'pending'),
+        (SELECT COUNT(*) FROM tasks WHERE status = 'done' AND finished_at >= since),
+        (SELECT COUNT(*) FROM diary WHERE created_at >= since),
+        (SELECT COALESCE(array_agg(DISTINCT agent), '{}')
+           FROM diary WHERE created_at >= since AND agent IS NOT NULL AND agent <> ''),
+        (SELECT COALESCE(jsonb_agg(to_jsonb(d) ORDER BY d.created_at DESC), '[]'::jsonb)
+           FROM (SELECT id, agent, event_type, content, created_at
+                   FROM diary
+                  ORDER BY created_at DESC
+                  LIMIT 5) d);
+$$;
@@ -0,0 +1,25 @@
+-- Индексы для списков дневника, расписания и квестов (get_diary / get_scheduled_tasks / get_quests)
+-- Выполнить в Supabase SQL Editor: https://supabase.com/dashboard/project/njhbitemndotsfxxwzat/sql
+--
+-- Списки отдаются как ORDER BY created_at DESC, id DESC LIMIT N, с фильтром и без,
+-- а следующая страница — через ?before=<created_at>&before_id=<id> последней строки
+-- ((created_at, id) < (before, before_id)). id нужен потому, что created_at
+-- пишется с точностью до секунды и у пачки строк совпадает.
+-- С этими индексами это чтение диапазона индекса вместо полной сортировки.
+-- На больших таблицах можно выполнять по одному с CREATE INDEX CONCURRENTLY
+-- (вне транзакции), чтобы не блокировать запись.
+
+CREATE INDEX IF NOT EXISTS diary_created_at_id_desc_idx
+    ON diary (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS diary_agent_created_at_id_desc_idx
+    ON diary (agent, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS scheduled_tasks_created_at_id_desc_idx
+    ON scheduled_tasks (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS scheduled_tasks_status_created_at_id_desc_idx
+    ON scheduled_tasks (status, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS quests_created_at_id_desc_idx
+    ON quests (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS quests_status_created_at_id_desc_idx
+    ON quests (status, created_at DESC, id DESC);
@@ -0,0 +1,28 @@
+-- Брифинг: последние записи дневника с укороченным content (StateManager.get_briefing)
+-- Выполнить в Supabase SQL Editor: https://supabase.com/dashboard/project/njhbitemndotsfxxwzat/sql
+--
+-- Заменяет функцию из 005: в last_diary content обрезан до 280 символов
+-- (BRIEFING_PREVIEW_CHARS в agents.py), полный текст — через /api/diary.
+-- Последние 5 записей берутся по diary_created_at_id_desc_idx из 006.
+
+CREATE OR REPLACE FUNCTION briefing_24h(since TIMESTAMPTZ)
+RETURNS TABLE (
+    quests_pending      BIGINT,
+    tasks_completed_24h BIGINT,
+    diary_entries_24h   BIGINT,
+    active_agents_24h   TEXT[],
+    last_diary          JSONB
+)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        (SELECT COUNT(*) FROM quests WHERE status = 'pending'),
+        (SELECT COUNT(*) FROM tasks WHERE status = 'done' AND finished_at >= since),
+        (SELECT COUNT(*) FROM diary WHERE created_at >= since),
+        (SELECT COALESCE(array_agg(DISTINCT agent), '{}')
+           FROM diary WHERE created_at >= since AND agent IS NOT NULL AND agent <> ''),
+        (SELECT COALESCE(jsonb_agg(to_jsonb(d) ORDER BY d.created_at DESC), '[]'::jsonb)
+           FROM (SELECT id, agent, event_type, left(content, 280) AS content, created_at
+                   FROM diary
+                  ORDER BY created_at DESC
+                  LIMIT 5) d);
+$$;
@@ -0,0 +1,9 @@
+-- Индекс для загрузки истории чата (StateManager.load_history)
+-- Выполнить в Supabase SQL Editor: https://supabase.com/dashboard/project/njhbitemndotsfxxwzat/sql
+--
+-- load_history берёт последние 100 сообщений: ORDER BY created_at DESC, id DESC LIMIT 100
+-- (id различает строки одной пачки — у них общий created_at).
+-- С индексом это чтение 100 записей индекса вместо сортировки всей таблицы.
+
+CREATE INDEX IF NOT EXISTS messages_created_at_id_desc_idx
+    ON messages (created_at DESC, id DESC);
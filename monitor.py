@@ -11,7 +11,7 @@ Features:
 
 import asyncio
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import httpx
 
@@ -83,7 +83,7 @@ class SystemMonitor:
         while self._running:
             try:
                 if self.state.db:
-                    cutoff = (datetime.utcnow() - timedelta(minutes=10)).isoformat()
+                    cutoff = (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
                     errors = await self.state.db.select("agent_errors", {
                         "created_at": f"gt.{cutoff}",
                         "limit": "20",
@@ -111,7 +111,7 @@ class SystemMonitor:
                         if last_change:
                             try:
                                 changed_at = datetime.fromisoformat(last_change)
-                                stuck_mins = (datetime.utcnow() - changed_at).total_seconds() / 60
+                                stuck_mins = (datetime.now(timezone.utc) - changed_at).total_seconds() / 60
                                 if stuck_mins > 10:
                                     await self._alert(
                                         f"stuck_{key}",
@@ -128,7 +128,7 @@ class SystemMonitor:
     async def _daily_report_loop(self):
         """Send daily summary at ~midnight UTC."""
         while self._running:
-            now = datetime.utcnow()
+            now = datetime.now(timezone.utc)
             # Next midnight
             tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
             wait_sec = (tomorrow - now).total_seconds()
@@ -149,7 +149,7 @@ class SystemMonitor:
         if not self.state.db:
             return ""
 
-        cutoff = (datetime.utcnow() - timedelta(hours=24)).isoformat()
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=24)).isoformat()
 
         # Count completed tasks
         tasks = await self.state.db.select("scheduled_tasks", {
@@ -187,7 +187,7 @@ class SystemMonitor:
 
     async def _alert(self, alert_type: str, message: str):
         """Send alert with 15-min cooldown per alert type."""
-        now = datetime.utcnow()
+        now = datetime.now(timezone.utc)
         last = self._alert_cooldown.get(alert_type)
         if last and (now - last).total_seconds() < 900:
             return  # cooldown active
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents import StateManager, SupabaseClient  # noqa: E402
+
+
+def make_state(handler) -> StateManager:
+    """StateManager whose Supabase requests are answered by `handler(request)`."""
+    state = StateManager()
+    state.db = SupabaseClient("http://supabase.test", "key")
+    state.db._client = httpx.AsyncClient(
+        base_url="http://supabase.test/rest/v1",
+        headers=state.db.headers,
+        transport=httpx.MockTransport(handler),
+    )
+    state.db.on_write = state._on_db_write
+    return state
@@ -0,0 +1,224 @@
+import asyncio
+from collections import Counter
+
+import httpx
+
+from conftest import make_state
+
+
+def test_analytics_fallback_error_is_not_cached():
+    hits = Counter()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hits[request.url.path] += 1
+        if request.url.path.endswith("/rpc/analytics_overview"):
+            return httpx.Response(404, json={"code": "PGRST202"})
+        if request.method == "HEAD":
+            return httpx.Response(500, json={"code": "XX000"})
+        return httpx.Response(200, json=[])
+
+    async def run():
+        state = make_state(handler)
+        first = await state.get_analytics_overview()
+        second = await state.get_analytics_overview()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["total_errors"] is None and first["total_memories"] is None
+    assert second == first
+    # Both calls reached the database: the failed result was not cached
+    assert hits["/rest/v1/agent_errors"] == 2
+    assert hits["/rest/v1/rpc/analytics_overview"] == 2
+
+
+def test_analytics_fallback_success_is_cached():
+    hits = Counter()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hits[request.url.path] += 1
+        if request.url.path.endswith("/rpc/analytics_overview"):
+            return httpx.Response(404, json={"code": "PGRST202"})
+        if request.method == "HEAD":
+            return httpx.Response(206, headers={"content-range": "0-0/3"})
+        return httpx.Response(200, json=[])
+
+    async def run():
+        state = make_state(handler)
+        first = await state.get_analytics_overview()
+        second = await state.get_analytics_overview()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["total_errors"] == 3 and second == first
+    assert hits["/rest/v1/agent_errors"] == 1
+
+
+def test_briefing_rpc_and_fallback_errors_are_not_cached():
+    hits = Counter()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hits[request.url.path] += 1
+        return httpx.Response(500, json={"code": "XX000", "message": "boom"})
+
+    async def run():
+        state = make_state(handler)
+        return [await state.get_briefing() for _ in range(2)]
+
+    first, second = asyncio.run(run())
+    assert first["quests_pending"] is None and first["diary_entries_24h"] is None
+    assert second == first
+    assert hits["/rest/v1/rpc/briefing_24h"] == 2
+    assert hits["/rest/v1/diary"] == 4
+
+
+def test_coerce_progress():
+    from agents import _coerce_progress
+
+    assert _coerce_progress(True) == 1 and type(_coerce_progress(True)) is int
+    assert type(_coerce_progress(False)) is int
+    assert _coerce_progress(42) == 42
+    assert _coerce_progress(42.9) == 42
+    assert _coerce_progress(" +7 ") == 7
+    assert _coerce_progress("--5") is None
+    assert _coerce_progress(float("nan")) is None
+    assert _coerce_progress(None) is None
+
+
+def test_bool_progress_is_broadcast_as_int():
+    from agents import StateManager
+
+    sent = []
+
+    async def broadcast(frame):
+        sent.append(frame)
+
+    async def run():
+        state = StateManager()
+        await state.apply_callback(broadcast, {"agent": "coder", "progress": True})
+        return state.agents["coder"].to_dict()["progress"]
+
+    progress = asyncio.run(run())
+    assert progress == 1 and type(progress) is int
+
+
+def test_diary_rows_share_the_bulk_writer():
+    import orjson
+
+    posts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        posts.append((request.url.path, orjson.loads(request.content)))
+        return httpx.Response(201)
+
+    async def run():
+        state = make_state(handler)
+        for i in range(3):
+            await state.add_diary_entry("coder", "status_change", f"step {i}")
+        state.add_user_message("hi")
+        await state.aclose()
+
+    asyncio.run(run())
+    by_path = dict(posts)
+    assert len(posts) == 2
+    assert [r["content"] for r in by_path["/rest/v1/diary"]] == ["step 0", "step 1", "step 2"]
+    assert [r["content"] for r in by_path["/rest/v1/messages"]] == ["hi"]
+
+
+def test_spawn_drops_work_past_the_cap(monkeypatch):
+    import agents
+
+    monkeypatch.setattr(agents, "BACKGROUND_TASKS_MAX", 2)
+    ran = []
+
+    async def work(i):
+        await asyncio.sleep(0)
+        ran.append(i)
+
+    async def run():
+        state = agents.StateManager()
+        tasks = [state._spawn(work(i)) for i in range(3)]
+        await asyncio.gather(*filter(None, tasks))
+        return tasks
+
+    tasks = asyncio.run(run())
+    assert tasks[2] is None
+    assert sorted(ran) == [0, 1]
+
+
+def test_broadcast_sends_plain_frames():
+    from agents import StateManager
+
+    sent = []
+
+    async def broadcast(frame):
+        sent.append(frame)
+
+    async def run():
+        state = StateManager()
+        await state.apply_callback(broadcast, {"agent": "coder", "status": "working", "message": "on it"})
+        await state.apply_callback(broadcast, {"agent": "writer", "status": "working"})
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert sent and all(f["type"] != "batch" for f in sent)
+    assert {f["agent"]["name"] for f in sent if f["type"] == "agent_update"} == {"coder", "writer"}
+
+
+def _stats_handler(hits, view_status, view_code):
+    def handler(request: httpx.Request) -> httpx.Response:
+        hits[request.url.path] += 1
+        if request.url.path.endswith("/agent_stats_v"):
+            return httpx.Response(view_status, json={"code": view_code})
+        if request.url.path.endswith("/agent_errors"):
+            return httpx.Response(200, json=[{"id": 1, "agent": "coder"}])
+        return httpx.Response(200, json=[])
+    return handler
+
+
+def test_agent_stats_fallback_only_for_missing_view_and_cached():
+    hits = Counter()
+
+    async def run():
+        state = make_state(_stats_handler(hits, 404, "PGRST205"))
+        return [await state.get_agent_stats() for _ in range(2)]
+
+    first, second = asyncio.run(run())
+    coder = next(s for s in first if s["agent"] == "coder")
+    assert coder["error_count"] == 1 and second == first
+    assert hits["/rest/v1/agent_stats_v"] == 2
+    assert hits["/rest/v1/agent_errors"] == 1
+
+
+def test_agent_stats_error_does_not_scan_tables():
+    hits = Counter()
+
+    async def run():
+        state = make_state(_stats_handler(hits, 500, "XX000"))
+        return await state.get_agent_stats()
+
+    assert asyncio.run(run()) == []
+    assert hits["/rest/v1/agent_errors"] == 0
+
+
+def test_error_summary_keeps_stored_text():
+    import orjson
+
+    patches = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "PATCH" and request.url.path.endswith("/tasks"):
+            patches.append(orjson.loads(request.content)["summary"])
+        return httpx.Response(200, json=[])
+
+    async def noop(frame):
+        pass
+
+    async def run():
+        state = make_state(handler)
+        await state.apply_callback(noop, {"agent": "coder", "status": "error", "taskId": 1})
+        await state.apply_callback(noop, {"agent": "coder", "status": "error", "taskId": 1, "message": ""})
+        await state.apply_callback(noop, {"agent": "coder", "status": "error", "taskId": 1, "message": " boom "})
+        await state.aclose()
+
+    asyncio.run(run())
+    assert patches == ["Agent error: Unknown error", "Agent error: ", "Agent error:  boom "]
@@ -281,7 +281,7 @@ async def cmd_tasks(update, context):
         return
     msg = await update.message.reply_text("⏳ Загружаю задачи…")
 
-    data = await _api_get("/api/scheduled-tasks?limit=10")
+    data = await _api_get("/api/scheduled-tasks?limit=10&summary=true")
     if not data:
         await msg.edit_text("❌ Не удалось загрузить задачи")
         return
@@ -554,7 +554,7 @@ async def handle_callback(update, context):
 # ── Inline versions of commands (called from /start menu) ───────────────────
 
 async def _inline_tasks(query):
-    data = await _api_get("/api/scheduled-tasks?limit=5")
+    data = await _api_get("/api/scheduled-tasks?limit=5&summary=true")
     tasks = (data or {}).get("tasks", [])
     if not tasks:
         await query.edit_message_text("📋 Нет задач")